@@ -0,0 +1,62 @@
+"""Conversion time of the dates of a page of trips, with time.strptime and
+with the converters of the lib (fast path and memo)::
+
+    python benchmarks/dates.py
+
+"""
+import time
+import datetime
+
+from bv.libclient.utils import api_to_date, api_to_time, api_to_datetime, \
+        convert_column
+
+from payloads import make_trips_page
+
+def strptime_date(value):
+    return datetime.date(*time.strptime(value, '%Y-%m-%d')[:3])
+
+def strptime_time(value):
+    return datetime.time(*time.strptime(value, '%H:%M:%S')[3:6])
+
+def strptime_datetime(value):
+    return datetime.datetime(*time.strptime(value, '%Y-%m-%d %H:%M:%S')[:6])
+
+COLUMNS = (
+    ('date', strptime_date, api_to_date),
+    ('time', strptime_time, api_to_time),
+    ('creation_date', strptime_datetime, api_to_datetime),
+    ('modification_date', strptime_datetime, api_to_datetime),
+)
+
+def timeit(func, repeat):
+    start = time.time()
+    for i in xrange(repeat):
+        func()
+    return (time.time() - start) * 1000 / repeat
+
+def main(count=100, repeat=50):
+    trips = make_trips_page(count)
+    columns = [([trip[key] for trip in trips], reference, converter)
+            for key, reference, converter in COLUMNS]
+
+    def convert(index):
+        for column in columns:
+            map(column[index], column[0])
+
+    def convert_cold():
+        for values, reference, converter in columns:
+            converter.cache_clear()
+            map(converter, values)
+
+    def convert_columns():
+        for values, reference, converter in columns:
+            convert_column(converter, values)
+
+    print 'dates of %d trips' % count
+    print 'strptime        %7.3f ms' % timeit(lambda: convert(1), repeat)
+    print 'converters      %7.3f ms' % timeit(lambda: convert(2), repeat)
+    print 'cold memo       %7.3f ms' % timeit(convert_cold, repeat)
+    print 'convert_column  %7.3f ms' % timeit(convert_columns, repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Micro-benchmark of the construction of ApiObjects.
+
+Compare the per-class hydration plans of ApiObject to the reflective loop it
+replaced, on a page of 20 trips with their nested user, offer and demand.
+As trips are lazily hydrated, "accessed" also touches every nested object
+and date::
+
+    python benchmarks/hydration.py
+
+"""
+import new
+import timeit
+
+from bv.libclient.libtrips import Trip
+from bv.libclient.utils import is_iterable, unicode_to_dict
+
+from payloads import make_trips_page
+
+def reflective_build(klass, data):
+    """Build an object of klass the way the former ApiObject.__init__ did,
+    with a reflective lookup per key.
+
+    """
+    obj = klass.__new__(klass) if isinstance(klass, type) else _blank(klass)
+    for key, value in unicode_to_dict(data).items():
+        cleaner = 'clean_'+key
+        if hasattr(obj, cleaner) and callable(getattr(obj, cleaner)):
+            value = getattr(obj, cleaner)(value)
+        if is_iterable(value):
+            if key in obj._class_keys:
+                value = reflective_build(obj._class_keys[key], value)
+        setattr(obj, key, value)
+    return obj
+
+def _blank(klass):
+    """Return an uninitialized instance of an old-style class."""
+    return new.instance(klass)
+
+def reflective_page(page):
+    return [reflective_build(Trip, data) for data in page]
+
+def planned_page(page):
+    return [Trip(**unicode_to_dict(data)) for data in page]
+
+def planned_page_accessed(page):
+    """Build the page and touch all the lazily hydrated attributes."""
+    trips = planned_page(page)
+    for trip in trips:
+        trip.user, trip.offer, trip.demand, trip.date, trip.time, \
+            trip.creation_date, trip.modification_date
+    return trips
+
+def main(number=500):
+    page = make_trips_page(20)
+    for name, func in (('reflective', reflective_page),
+            ('planned', planned_page),
+            ('accessed', planned_page_accessed)):
+        duration = min(timeit.repeat(lambda: func(page), number=number,
+            repeat=3))
+        print '%-12s %8.1f us per page' % (name, duration / number * 1e6)
+
+if __name__ == '__main__':
+    main()
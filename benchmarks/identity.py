@@ -0,0 +1,44 @@
+"""Time to build a list of messages and reach their nested talk, trip and
+users, without and with the identity map; every message of the list
+carries a copy of the same talk::
+
+    python benchmarks/identity.py
+
+"""
+import json
+import time
+
+from bv.libclient.libtalks import Message
+from bv.libclient.utils import dict_to_object_list_func, unicode_to_dict
+
+from payloads import make_messages
+
+def touch(messages):
+    """Hydrate the nested objects and return how many distinct ones exist.
+
+    """
+    objects = set()
+    for message in messages:
+        talk = message.talk
+        objects.update([id(talk), id(talk.trip), id(talk.trip.user),
+            id(talk.from_user), id(message.user)])
+    return len(objects)
+
+def without_map(dicts):
+    return [Message(**unicode_to_dict(d)) for d in dicts]
+
+def with_map(dicts):
+    return dict_to_object_list_func(dicts, Message)
+
+def main(count=500, repeat=20):
+    body = json.dumps(make_messages(count))
+    print 'list of %d messages' % count
+    for name, build in (('without map', without_map), ('with map', with_map)):
+        start = time.time()
+        for i in xrange(repeat):
+            distinct = touch(build(json.loads(body)))
+        print '%-12s %7.3f ms, %4d distinct nested objects' % (name,
+            (time.time() - start) * 1000 / repeat, distinct)
+
+if __name__ == '__main__':
+    main()
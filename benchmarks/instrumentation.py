@@ -0,0 +1,42 @@
+"""Overhead of the instrumentation hooks on a request, the network being
+replaced by an immediate answer::
+
+    python benchmarks/instrumentation.py
+
+"""
+import time
+
+from restkit import Resource
+
+from bv.libclient.baselib import BvResource
+from bv.libclient.httpcache import CachedResponse
+from bv.libclient.instrumentation import add_hook, remove_hook, RequestStats
+
+def fake_request(self, *args, **kwargs):
+    return CachedResponse(200, {}, '{"id": 7}')
+
+def timeit(resource, repeat):
+    start = time.time()
+    for i in xrange(repeat):
+        resource.get(path='7/').body_string()
+    return (time.time() - start) * 1000000 / repeat
+
+def main(repeat=100000):
+    original = Resource.request
+    Resource.request = fake_request
+    try:
+        resource = BvResource('http://api.example.com/trips/')
+        resource.endpoint = 'trip'
+        print 'no hooks      %6.2f us per request' % timeit(resource, repeat)
+        stats = RequestStats()
+        add_hook(stats)
+        try:
+            print 'RequestStats  %6.2f us per request' % timeit(resource,
+                    repeat)
+        finally:
+            remove_hook(stats)
+    finally:
+        Resource.request = original
+
+if __name__ == '__main__':
+    main()
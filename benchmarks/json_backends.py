@@ -0,0 +1,34 @@
+"""Decoding and encoding times of the installed json backends, on a page of
+trips and on a search result::
+
+    python benchmarks/json_backends.py
+
+"""
+import json
+import time
+
+from bv.libclient.jsoncodec import get_available_backends
+
+from payloads import make_trips_page, make_search_result
+
+def timeit(func, value, repeat):
+    start = time.time()
+    for i in xrange(repeat):
+        func(value)
+    return (time.time() - start) * 1000 / repeat
+
+def main(repeat=200):
+    payloads = [
+        ('trips page', make_trips_page(100)),
+        ('search result', make_search_result(100)),
+    ]
+    for label, payload in payloads:
+        body = json.dumps(payload)
+        print '%s: %d bytes' % (label, len(body))
+        for backend in get_available_backends():
+            print '    %-12s loads %7.3f ms, dumps %7.3f ms' % (backend.name,
+                timeit(backend.loads, body, repeat),
+                timeit(backend.dumps, payload, repeat))
+
+if __name__ == '__main__':
+    main()
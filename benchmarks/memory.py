@@ -0,0 +1,64 @@
+"""Memory used per object by the regular and the compact models.
+
+Build a few thousand trips, with their nested user, offer and demand, in
+both modes and report the size of the python objects holding them, as built
+(the lazy attributes still raw) and once every attribute has been accessed::
+
+    python benchmarks/memory.py
+
+"""
+import sys
+
+from bv.libclient.libtrips import Trip
+from bv.libclient.utils import dict_to_object_list_func, set_compact_models
+
+from payloads import make_trips_page
+
+def hydrate(obj):
+    """Access every attribute of an ApiObject and of its nested ApiObjects,
+    so the lazy ones are built.
+
+    """
+    for value in obj._get_fields().values():
+        if hasattr(value, '_get_attrs'):
+            hydrate(value)
+
+def object_size(obj):
+    """Return the size of an ApiObject, its attributes storage, the storage
+    of its lazy attributes and its nested ApiObjects (attribute values are
+    shared between both modes and not counted).
+
+    """
+    size = sys.getsizeof(obj)
+    fields = getattr(obj, '__dict__', None)
+    if fields is None:
+        if obj._extra is not None:
+            size += sys.getsizeof(obj._extra)
+        # don't build the lazy attributes by accessing them
+        raw = obj._raw or {}
+        fields = dict([(name, getattr(obj, name)) for name in obj._slots
+            if name not in raw and hasattr(obj, name)])
+    else:
+        size += sys.getsizeof(fields)
+    if obj._raw is not None:
+        size += sys.getsizeof(obj._raw)
+    for value in fields.values():
+        if hasattr(value, '_get_attrs'):
+            size += object_size(value)
+    return size
+
+def main(count=2000):
+    page = make_trips_page(count)
+    for name, compact in (('regular', False), ('compact', True)):
+        set_compact_models(compact)
+        trips = dict_to_object_list_func(page, Trip)
+        built = sum([object_size(trip) for trip in trips])
+        for trip in trips:
+            hydrate(trip)
+        hydrated = sum([object_size(trip) for trip in trips])
+        print '%-8s %6d bytes per trip as built, %6d with its user, offer ' \
+                'and demand built' % (name, built / count, hydrated / count)
+    set_compact_models(False)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Realistic API payloads shared by the benchmarks.
+
+"""
+def make_user(user_id):
+    return {
+        'id': user_id,
+        'username': 'user%s' % user_id,
+        'first_name': 'Jean',
+        'last_name': 'Dupont',
+        'email': 'user%s@example.com' % user_id,
+    }
+
+def make_trip(trip_id):
+    return {
+        'id': trip_id,
+        'name': 'Trip %s' % trip_id,
+        'departure_city': 'Nantes',
+        'departure_address': '1 rue de la Paix',
+        'arrival_city': 'Rennes',
+        'arrival_address': '2 place de la Gare',
+        'date': '2010-12-%02d' % (trip_id % 28 + 1),
+        'time': '08:%02d:00' % (trip_id % 60),
+        'dows': [0, 2, 4],
+        'interval_min': 0,
+        'interval_max': 2,
+        'regular': False,
+        'alert': True,
+        'creation_date': '2010-11-02 10:12:00',
+        'modification_date': '2010-11-03 18:47:12',
+        'user': make_user(trip_id % 7),
+        'offer': {
+            'steps': ['Nantes', 'Nort-sur-Erdre', 'Rennes'],
+            'radius': 10,
+            'route': 'LINESTRING(-1.55 47.21, -1.67 48.11)',
+        },
+        'demand': {
+            'radius': 5,
+        },
+    }
+
+def make_trips_page(count=20):
+    return [make_trip(i) for i in range(count)]
+
+def make_search_result(count=20):
+    return {
+        'trip': make_trip(0),
+        'trip_offers': make_trips_page(count),
+        'trip_demands': make_trips_page(count),
+    }
+
+def make_talk(talk_id):
+    return {
+        'id': talk_id,
+        'trip': make_trip(talk_id),
+        'from_user': make_user(talk_id + 1),
+    }
+
+def make_messages(count=20):
+    talk = make_talk(1)
+    return [{
+        'id': i,
+        'talk': talk,
+        'from_user': bool(i % 2),
+        'message': 'Hello %s' % i,
+        'date': '2010-11-02 10:%02d:00' % (i % 60),
+    } for i in range(count)]
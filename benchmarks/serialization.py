@@ -0,0 +1,37 @@
+"""Serialization time of a page of trips, with the former dir() based
+to_dict and with to_dict / to_json::
+
+    python benchmarks/serialization.py
+
+"""
+import time
+
+from bv.libclient.libtrips import Trip
+from bv.libclient.utils import dict_to_object_list_func
+
+from payloads import make_trips_page
+
+def scan_to_dict(obj):
+    init = {}
+    keys = [item for item in dir(obj) + list(obj._raw or ())
+        if not (callable(getattr(obj, item)) or item.startswith(('__', '_')))]
+    for key in keys:
+        init[key] = getattr(obj, key)
+    return init
+
+def timeit(func, trips, repeat):
+    start = time.time()
+    for i in xrange(repeat):
+        for trip in trips:
+            func(trip)
+    return (time.time() - start) * 1000 / repeat
+
+def main(count=100, repeat=20):
+    trips = dict_to_object_list_func(make_trips_page(count), Trip)
+    print 'serialization of %d trips' % count
+    print 'dir() scan  %7.3f ms' % timeit(scan_to_dict, trips, repeat)
+    print 'to_dict     %7.3f ms' % timeit(Trip.to_dict, trips, repeat)
+    print 'to_json     %7.3f ms' % timeit(Trip.to_json, trips, repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""Time to the first object when decoding a large list of trips, with the
+regular decoding (json.loads of the whole body) and the streaming one::
+
+    python benchmarks/streaming.py
+
+"""
+import json
+import time
+
+from bv.libclient.libtrips import Trip
+from bv.libclient.utils import dict_to_object_list_func, dict_to_object_iter
+from bv.libclient.jsonstream import iter_json_array
+
+from payloads import make_trips_page
+
+def main(count=5000):
+    body = json.dumps(make_trips_page(count))
+    print 'body of %d trips: %d bytes' % (count, len(body))
+
+    start = time.time()
+    trips = dict_to_object_list_func(json.loads(body), Trip)
+    first = time.time()
+    print 'regular    first object after %7.1f ms, all after %7.1f ms' % (
+        (first - start) * 1000, (time.time() - start) * 1000)
+
+    start = time.time()
+    trips = dict_to_object_iter(iter_json_array(body), Trip)
+    trips.next()
+    first = time.time()
+    for trip in trips:
+        pass
+    print 'streaming  first object after %7.1f ms, all after %7.1f ms' % (
+        (first - start) * 1000, (time.time() - start) * 1000)
+
+if __name__ == '__main__':
+    main()
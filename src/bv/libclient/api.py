@@ -12,5 +12,9 @@ from bv.libclient.libtrips import LibTrips, Trip, Offer, Demand
 from bv.libclient.libusers import LibUsers, User
 from bv.libclient.libtalks import LibTalks, Talk, Message
 from bv.libclient.libratings import LibRatings, Rating, TempRating
+from bv.libclient.client import BvClient
+from bv.libclient.libthreaded import ThreadedLibTrips, ThreadedLibUsers, \
+        ThreadedLibTalks, ThreadedLibRatings
+from bv.libclient.workers import WorkerPool, wait_all
 from bv.libclient.utils import unicode_to_dict 
 from bv.libclient.exceptions import *
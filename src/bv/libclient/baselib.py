@@ -4,57 +4,257 @@ from restkit.errors import ResourceNotFound, Unauthorized, RequestError, Request
 from bv.libclient.exceptions import ResourceAccessForbidden, \
         ResourceDoesNotExist, ApiException
 from bv.libclient.utils import json_unpack
+from bv.libclient.pool import get_pool
+from bv.libclient.workers import get_worker_pool, WorkerPool
+from bv.libclient.instrumentation import hooks, RequestEvent, \
+        InstrumentedResponse
+from bv.libclient.retry import get_default_retry_policy
+from bv.libclient.httpcache import CachedResponse
+from bv.libclient.constants import DEFAULT_PAGINATION, DEFAULT_PREFETCH, \
+        DEFAULT_WORKERS, DEFAULT_PAGE_RETRIES
+from collections import deque
 import httplib2
 
 class BvResource(Resource):
     """A Bison Vert Resource
 
+    If an http cache is set, the GET requests are made conditional. If a
+    read cache is set, the identical GET requests are only made once. If a
+    retry policy is set, the requests failing for a transient reason are
+    retried. If a circuit breaker is set, the requests fail at once while it
+    is open. If a single flight is set, concurrent identical GET requests are
+    only made once.
+
     """
-    def request(self, *args, **kwargs):
+    http_cache = None
+    read_cache = None
+    # name of the endpoint reported to the instrumentation hooks
+    endpoint = None
+    retry_policy = None
+    circuit_breaker = None
+    single_flight = None
+
+    def get_credentials_scope(self):
+        """Return the oauth consumer and token keys used by this resource.
+
+        """
+        scope = []
+        for f in self.filters:
+            consumer = getattr(f, 'consumer', None)
+            token = getattr(f, 'token', None)
+            if consumer is not None or token is not None:
+                scope.append((getattr(consumer, 'key', None),
+                    getattr(token, 'key', None)))
+        return tuple(scope)
+
+    def get_cache_key(self, path=None, params_dict=None, **params):
+        """Return a key identifying a GET on this resource.
+
+        """
+        params = dict(params)
+        params.update(params_dict or {})
+        return repr((self.uri, path, sorted(params.items()),
+            self.get_credentials_scope()))
+
+    def request(self, method, path=None, payload=None, headers=None,
+            params_dict=None, **params):
         """Redefine the request method to raise our proper exception when
         needed, and not expose the underlying lib.
 
         """
+        if method != 'GET':
+            try:
+                return self._request(method, path, payload, headers,
+                        params_dict, **params)
+            finally:
+                if self.read_cache is not None:
+                    # the data read so far may have changed
+                    self.read_cache.clear()
+        if self.read_cache is None and self.single_flight is None:
+            return self._get(path, headers, params_dict, params)
+        key = self.get_cache_key(path, params_dict, **params)
+        if self.read_cache is not None:
+            resp = self.read_cache.get(key)
+            if resp is not None:
+                return resp
+        if self.single_flight is not None:
+            resp = self._shared_get(key, path, headers, params_dict, params)
+        else:
+            resp = self._get(path, headers, params_dict, params)
+        if self.read_cache is not None and resp.status_int == 200:
+            resp = self.read_cache.store(key, resp)
+        return resp
+
+    def _shared_get(self, key, path, headers, params_dict, params):
+        """Make the GET, or wait for the identical one already in flight, and
+        give each caller its own copy of the response.
+
+        """
+        def get():
+            resp = self._get(path, headers, params_dict, params)
+            return resp.status_int, dict(resp.headers), resp.body_string()
+        return CachedResponse(*self.single_flight.do(key, get))
+
+    def _get(self, path, headers, params_dict, params):
+        if self.http_cache is not None:
+            return self._cached_request(path, headers, params_dict, params)
+        return self._request('GET', path, None, headers, params_dict,
+                **params)
+
+    def _cached_request(self, path, headers, params_dict, params):
+        """Make a GET conditional on the validators of the cached response,
+        and serve the cached body if the server answers 304.
+
+        """
+        key = self.get_cache_key(path, params_dict, **params)
+        entry = self.http_cache.get(key)
+        if entry is not None:
+            if isinstance(headers, dict):
+                headers = headers.items()
+            headers = list(headers or []) + entry.get_validation_headers()
+        resp = self._request('GET', path, None, headers, params_dict, **params)
+        if entry is not None and resp.status_int == 304:
+            # release the connection of the empty answer to the pool
+            resp.close()
+            return self.http_cache.revalidated(entry)
+        if resp.status_int == 200:
+            return self.http_cache.store(key, resp)
+        return resp
+
+    def _request(self, method, path=None, payload=None, headers=None,
+            params_dict=None, **params):
+        """Make the request through the circuit breaker, retrying it
+        according to the retry policy.
+
+        """
+        send = lambda: self._send(method, path, payload, headers, params_dict,
+                **params)
+        if self.circuit_breaker is not None:
+            send_once = send
+            send = lambda: self.circuit_breaker.call(send_once)
+        if self.retry_policy is None:
+            return send()
+        return self.retry_policy.call(method, send)
+
+    def _send(self, method, path=None, payload=None, headers=None,
+            params_dict=None, **params):
+        """Make one attempt of the request, reporting it to the
+        instrumentation hooks if there are some.
+
+        """
+        if not hooks:
+            return super(BvResource, self).request(method, path, payload,
+                    headers, params_dict, **params)
+        event = RequestEvent(self.endpoint, method, self.uri, path, payload)
         try:
-            # baselib : lors d'un appel a request
-            # lib -> get_resource
-            # ex: libUser.get_active_user()
-            return super(BvResource, self).request(*args, **kwargs)
+            resp = super(BvResource, self).request(method, path, payload,
+                    headers, params_dict, **params)
         except Exception as e:
-            
-            print "Erreur au niveau de BvResource.request()"
-            print e
-            # for debugging purposes. FIXME
-            raise e
-#        except ResourceNotFound as e:
-#            raise ResourceDoesNotExist(e.response)
-#        except Unauthorized as e:
-#            raise ResourceAccessForbidden(e.response)
-#        except RequestError as e:
-#            raise ApiException(e)
+            event.finish(e)
+            raise
+        event.headers_received(resp.status_int)
+        return InstrumentedResponse(resp, event)
+
+# options of the request pipeline, passed as is to the libs sharing a lib's
+# parameters; the ones that are also BvResource attributes are set on the
+# resources
+PIPELINE_OPTIONS = ('http_cache', 'identity_map', 'read_cache',
+        'retry_policy', 'circuit_breakers', 'single_flight')
+
+# value of a pipeline option meaning "use the default", None disabling it
+DEFAULT = object()
+
+def get_pipeline_options(options):
+    """Return a dict of all the pipeline options, the missing ones (or the
+    DEFAULT ones) set to their default.
+
+    """
+    unknown = [name for name in options if name not in PIPELINE_OPTIONS]
+    if unknown:
+        raise TypeError('Unexpected arguments: %s' % ', '.join(sorted(unknown)))
+    result = dict.fromkeys(PIPELINE_OPTIONS)
+    result['retry_policy'] = DEFAULT
+    result.update(options)
+    if result['retry_policy'] is DEFAULT:
+        result['retry_policy'] = get_default_retry_policy()
+    return result
+
+def make_oauth_filters(consumer_key, consumer_secret, token_key, token_secret):
+    """Return the oauth filters for the given credentials, or None if there
+    is no token.
+
+    """
+    if None in (token_key, token_secret):
+        return None
+    consumer = oauth2.Consumer(key=consumer_key, secret=consumer_secret)
+    token = oauth2.Token(token_key, token_secret)
+    return [OAuthFilter('*', consumer, token)]
 
 class BaseLib:
     _api_base_url = ''
     _resource_class = BvResource
     
-    def __init__(self, server_url=None, consumer_key=None, consumer_secret=None, token_key=None, token_secret=None, filters=None):
+    def __init__(self, server_url=None, consumer_key=None, consumer_secret=None, token_key=None, token_secret=None, filters=None, pool=None, resources=None,
+            pool_options=None, **options):
         """Initialize the lib with http oauth client if provided
+
+        All the libs pointing to the same server_url share the same pool of
+        keep-alive connections, unless a specific pool is given.
+        `pool_options` (max_connections, idle_timeout, timeout) configure
+        that shared pool; see bv.libclient.pool.get_pool.
+
+        `resources` is the dict used to cache the built resources; it can be
+        shared between libs using the same filters.
+
+        The other arguments are the options of the request pipeline
+        (PIPELINE_OPTIONS), kept in the `options` dict and readable as
+        attributes of the lib.
+
+        If an `http_cache` (see bv.libclient.httpcache) is given, the GET
+        requests are conditional and 304 answers are served from the cache.
+
+        If an `identity_map` (see bv.libclient.utils.IdentityMap) is given,
+        the identical nested objects of all the responses share one instance,
+        instead of the ones of each response only.
+
+        If a `read_cache` (see bv.libclient.httpcache.ReadCache) is given,
+        the identical GET requests are made only once while it is not cleared.
+
+        The idempotent requests failing for a transient reason are retried
+        according to `retry_policy` (see bv.libclient.retry.RetryPolicy), or
+        to the default policy if not given; None disables the retries.
+
+        If `circuit_breakers` (see bv.libclient.circuitbreaker) are given,
+        each endpoint gets its own breaker, failing fast while the endpoint
+        is failing.
+
+        If a `single_flight` (see bv.libclient.singleflight) is given, the
+        callers making a GET identical to one in flight (same url, query and
+        credentials) wait for it and share its response.
         
         """
         self.server_url = server_url
+        if resources is None:
+            resources = {}
+        self._resources = resources
+        self.options = get_pipeline_options(options)
+        if pool is None:
+            pool = get_pool(server_url, **(pool_options or {}))
+        self.pool = pool
         if filters:
             self.set_filters(filters)
         else:
-            if None in (token_key, token_secret):
-                # we do not want an authenticated request.
-                self._oauth = False
-                self._filters = None
-            else:
-                consumer = oauth2.Consumer(key=consumer_key, secret=consumer_secret)
-                token= oauth2.Token(token_key, token_secret)
-                self._filters = [OAuthFilter('*', consumer, token)]
-                self._oauth = True
+            self._filters = make_oauth_filters(consumer_key, consumer_secret,
+                    token_key, token_secret)
+            # we do not want an authenticated request if there is no token.
+            self._oauth = self._filters is not None
     
+    def __getattr__(self, name):
+        options = self.__dict__.get('options')
+        if options is not None and name in options:
+            return options[name]
+        raise AttributeError(name)
+
     def get_filters(self):
         """return the existing client for this instance of lib.
 
@@ -64,15 +264,25 @@ class BaseLib:
     def set_filters(self, filters):
         self._filters = filters
         self._oauth = True
+        self.invalidate_resources()
+
+    def invalidate_resources(self):
+        """Forget the resources built so far, eg. when the credentials have
+        changed.
+
+        """
+        self._resources.clear()
     
     def get_params(self):
         """Return the parameters needed to create a new lib instance.
 
         """
-        return {
-            'server_url': self.server_url,
-            'filters': self.get_filters(),
-        }
+        return dict(self.options,
+            server_url=self.server_url,
+            filters=self.get_filters(),
+            pool=self.pool,
+            resources=self._resources,
+        )
 
     def get_resource_name(self, path):
         """Return a complete URL from a key
@@ -82,16 +292,34 @@ class BaseLib:
     
     def get_resource(self, key=None, path=None, filters=None):
         """Return a restkit resource object
+
+        Resources are built once per (key, path, filters) and then reused by
+        the next calls on this lib instance; equal lists of filters (no
+        filters at all included) share the same resource.
         
         """
+        if filters == None:
+            filters = self._filters
+        cache_key = (self.__class__, key, path, tuple(filters or ()))
+        resource = self._resources.get(cache_key)
+        if resource is not None:
+            return resource
         if key and key in self._urls:
             path = self._urls[key]
         try: 
-            if filters == None:
-                filters = self._filters
-            return self._resource_class(self.get_resource_name(path), filters=filters)
+            resource = self._resource_class(self.get_resource_name(path),
+                    filters=filters, pool_instance=self.pool)
         except RequestFailed as e:
             raise Exception(e.response.body)
+        resource.endpoint = key or path
+        for name, value in self.options.items():
+            if hasattr(self._resource_class, name):
+                setattr(resource, name, value)
+        circuit_breakers = self.options['circuit_breakers']
+        if circuit_breakers is not None:
+            resource.circuit_breaker = circuit_breakers.get(resource.endpoint)
+        self._resources[cache_key] = resource
+        return resource
     
     def _get_pagination_params(self, page, count):
         return {
@@ -99,3 +327,106 @@ class BaseLib:
             'count': int(count)
         }
 
+    def _iter_pages(self, list_method, count=DEFAULT_PAGINATION,
+            prefetch=DEFAULT_PREFETCH, workers=None, **kwargs):
+        """Yield all the items returned by list_method, page after page.
+
+        While a page is consumed, the `prefetch` next ones are fetched in the
+        background, so at most prefetch + 1 pages are held in memory. The
+        iteration stops on the first page having less than `count` items.
+
+        """
+        if workers is None and prefetch:
+            workers = get_worker_pool()
+        pending = deque()
+        next_page = 1
+        while True:
+            if pending:
+                items = pending.popleft().result()
+            else:
+                items = list_method(page=next_page, count=count, **kwargs)
+                next_page += 1
+            last = len(items) < count
+            while not last and len(pending) < prefetch:
+                pending.append(workers.submit(list_method, page=next_page,
+                    count=count, **kwargs))
+                next_page += 1
+            for item in items:
+                yield item
+            if last:
+                break
+
+    def _fetch_all(self, list_method, count_method, count=DEFAULT_PAGINATION,
+            workers=DEFAULT_WORKERS, retries=DEFAULT_PAGE_RETRIES, **kwargs):
+        """Return all the items of list_method, fetching the pages
+        concurrently.
+
+        The number of pages is planned thanks to count_method. Each page is
+        fetched in one of `workers` threads and retried up to `retries` times
+        if it fails; the last error is raised if a page still can't be
+        fetched.
+
+        """
+        count = int(count)
+        total = int(count_method())
+        nb_pages = (total + count - 1) // count
+        if not nb_pages:
+            return []
+        pool = WorkerPool(size=min(workers, nb_pages))
+        try:
+            def fetch(page):
+                return pool.submit(list_method, page=page, count=count,
+                        **kwargs)
+            futures = dict([(page, fetch(page))
+                for page in range(1, nb_pages + 1)])
+            pages = {}
+            while futures:
+                failed = {}
+                for page, future in futures.items():
+                    if future.exception() is None:
+                        pages[page] = future.result()
+                    elif retries > 0:
+                        failed[page] = fetch(page)
+                    else:
+                        future.result()
+                futures = failed
+                retries -= 1
+        finally:
+            pool.shutdown()
+        items = []
+        for page in range(1, nb_pages + 1):
+            items.extend(pages[page])
+        return items
+
+    def _get_many(self, get_method, ids, workers=DEFAULT_WORKERS):
+        """Return a dict mapping each id to the result of get_method(id).
+
+        Duplicated ids are fetched only once, and at most `workers` calls run
+        at the same time. An id that does not exist is mapped to a
+        ResourceDoesNotExist exception instead of failing the whole batch.
+
+        """
+        ids = list(ids)
+        unique_ids = []
+        seen = set()
+        for id in ids:
+            if id not in seen:
+                seen.add(id)
+                unique_ids.append(id)
+        if not unique_ids:
+            return {}
+
+        def get(id):
+            try:
+                return get_method(id)
+            except ResourceNotFound as e:
+                return ResourceDoesNotExist(e)
+            except ResourceDoesNotExist as e:
+                return e
+
+        pool = WorkerPool(size=min(workers, len(unique_ids)))
+        try:
+            futures = pool.map(get, unique_ids)
+            return dict(zip(unique_ids, [f.result() for f in futures]))
+        finally:
+            pool.shutdown()
@@ -0,0 +1,244 @@
+"""Circuit breakers, failing fast when an endpoint of the API is failing or
+too slow instead of letting every caller wait for it.
+
+A breaker is closed while the calls succeed. When too many of the calls of
+the last `window` seconds failed or were slow, it opens: the calls then fail
+at once with CircuitOpen. After `open_timeout` seconds it is half-open and
+lets `half_open_calls` probes through; it closes again if they succeed, and
+opens again otherwise::
+
+    lib = LibTrips(server_url,
+                   circuit_breakers=get_circuit_breakers(server_url))
+
+"""
+import time
+import socket
+import threading
+from collections import deque
+
+from restkit.errors import RequestError, RequestTimeout, ResourceError
+
+from bv.libclient.exceptions import CircuitOpen
+from bv.libclient.constants import CIRCUIT_WINDOW, CIRCUIT_MIN_CALLS, \
+        CIRCUIT_FAILURE_RATE, CIRCUIT_SLOW_CALL, CIRCUIT_SLOW_RATE, \
+        CIRCUIT_OPEN_TIMEOUT, CIRCUIT_HALF_OPEN_CALLS
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+class CircuitBreaker(object):
+    """The breaker of one endpoint.
+
+    :param window: seconds of calls taken into account.
+    :param min_calls: calls needed in the window before the breaker can open.
+    :param failure_rate: rate of failed calls opening the breaker.
+    :param slow_call: seconds after which a call is slow.
+    :param slow_rate: rate of slow calls opening the breaker.
+    :param open_timeout: seconds before an open breaker lets probes through.
+    :param half_open_calls: number of concurrent probes.
+
+    """
+    clock = staticmethod(time.time)
+
+    def __init__(self, name=None, window=CIRCUIT_WINDOW,
+            min_calls=CIRCUIT_MIN_CALLS, failure_rate=CIRCUIT_FAILURE_RATE,
+            slow_call=CIRCUIT_SLOW_CALL, slow_rate=CIRCUIT_SLOW_RATE,
+            open_timeout=CIRCUIT_OPEN_TIMEOUT,
+            half_open_calls=CIRCUIT_HALF_OPEN_CALLS):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_timeout = open_timeout
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.opened_at = None
+        self.rejected = 0
+        self._calls = deque()
+        self._failures = 0
+        self._slow = 0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def is_failure(self, exception):
+        """Return True if the exception shows the endpoint is failing (and
+        not that the call itself is wrong).
+
+        """
+        if isinstance(exception, ResourceError):
+            return exception.status_int is None or exception.status_int >= 500
+        return isinstance(exception, (RequestError, RequestTimeout,
+            socket.error))
+
+    def _prune(self, now):
+        calls = self._calls
+        while calls and calls[0][0] < now - self.window:
+            when, failed, slow = calls.popleft()
+            self._failures -= failed
+            self._slow -= slow
+
+    def _reset_window(self):
+        self._calls.clear()
+        self._failures = self._slow = 0
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self._probes = 0
+        self._reset_window()
+
+    def before_call(self):
+        """Raise CircuitOpen if the call must not be made, return True if the
+        call is a probe of a half-open breaker.
+
+        """
+        if self.state == CLOSED:
+            return False
+        self._lock.acquire()
+        try:
+            if self.state == OPEN:
+                if self.clock() - self.opened_at < self.open_timeout:
+                    self.rejected += 1
+                    raise CircuitOpen('The circuit of %s is open' % self.name)
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpen('The circuit of %s is half-open'
+                            % self.name)
+                self._probes += 1
+                return True
+            return False
+        finally:
+            self._lock.release()
+
+    def record(self, failed, duration, probe=False):
+        """Record the outcome of a call made after before_call.
+
+        """
+        now = self.clock()
+        slow = duration >= self.slow_call
+        self._lock.acquire()
+        try:
+            if probe:
+                if self.state == HALF_OPEN:
+                    if failed:
+                        self._open(now)
+                    else:
+                        self.state = CLOSED
+                        self.opened_at = None
+                        self._probes = 0
+                        self._reset_window()
+                return
+            if self.state != CLOSED:
+                # calls started before the breaker opened
+                return
+            self._calls.append((now, failed, slow))
+            self._failures += failed
+            self._slow += slow
+            self._prune(now)
+            count = len(self._calls)
+            if count >= self.min_calls and (
+                    self._failures >= count * self.failure_rate
+                    or self._slow >= count * self.slow_rate):
+                self._open(now)
+        finally:
+            self._lock.release()
+
+    def call(self, func):
+        """Call func (taking no arguments) through the breaker.
+
+        """
+        probe = self.before_call()
+        start = self.clock()
+        try:
+            result = func()
+        except Exception as e:
+            self.record(self.is_failure(e), self.clock() - start, probe)
+            raise
+        self.record(False, self.clock() - start, probe)
+        return result
+
+    def get_state(self):
+        """Return the state of the breaker and the counts of its window.
+
+        """
+        self._lock.acquire()
+        try:
+            self._prune(self.clock())
+            return {
+                'state': self.state,
+                'calls': len(self._calls),
+                'failures': self._failures,
+                'slow': self._slow,
+                'rejected': self.rejected,
+                'opened_at': self.opened_at,
+            }
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.state = CLOSED
+            self.opened_at = None
+            self._probes = 0
+            self._reset_window()
+        finally:
+            self._lock.release()
+
+class CircuitBreakers(object):
+    """The breakers of the endpoints of a server, built on first use with
+    the given CircuitBreaker parameters.
+
+    """
+    def __init__(self, **options):
+        self.options = options
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint):
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            self._lock.acquire()
+            try:
+                breaker = self._breakers.get(endpoint)
+                if breaker is None:
+                    breaker = CircuitBreaker(endpoint, **self.options)
+                    self._breakers[endpoint] = breaker
+            finally:
+                self._lock.release()
+        return breaker
+
+    def get_states(self):
+        return dict([(endpoint, breaker.get_state())
+            for endpoint, breaker in self._breakers.items()])
+
+    def reset(self):
+        for breaker in self._breakers.values():
+            breaker.reset()
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+def get_circuit_breakers(server_url):
+    """Return the breakers shared by all the libs using server_url.
+
+    """
+    _registry_lock.acquire()
+    try:
+        if server_url not in _registry:
+            _registry[server_url] = CircuitBreakers()
+        return _registry[server_url]
+    finally:
+        _registry_lock.release()
+
+def get_circuit_states():
+    """Return the state of every shared breaker, by server url and endpoint.
+
+    """
+    return dict([(server_url, breakers.get_states())
+        for server_url, breakers in _registry.items()])
@@ -0,0 +1,181 @@
+"""Client-side prefix index for the cities autocompletion.
+
+The server answers /cities/<prefix>/ with at most `limit` cities. When it
+returns less than that, the answer is complete: every city starting with a
+longer prefix is in it, so the next keystrokes can be answered locally, in
+the order of the server.
+
+An answer is only indexed if the name of each of its cities can be read and
+starts with the prefix; otherwise the longer prefixes are asked to the
+server. The answers are kept `ttl` seconds, at most `max_entries` of them,
+the least recently used being evicted first.
+
+"""
+import json
+import time
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+from bv.libclient.constants import CITIES_RESULT_LIMIT, REFERENCE_CACHE_TTL, \
+        REFERENCE_CACHE_MAX_ENTRIES
+
+def normalize_city_prefix(value):
+    """Normalize a prefix the same way the lib builds the cities url.
+
+    """
+    return value.replace(' ', '-').lower()
+
+def get_city_name(city):
+    """Return the name of a city as returned by the API, or None if it has
+    no readable name.
+
+    """
+    if isinstance(city, dict):
+        city = city.get('name')
+    if isinstance(city, basestring):
+        return city
+    return None
+
+class CityIndex(object):
+    """Keep the complete results of the server, by prefix, and answer the
+    longer prefixes from them.
+
+    :param limit: maximum number of cities returned by the server.
+    :param get_name: callable returning the name of a city, or None.
+    :param ttl: seconds a result of the server is kept.
+    :param max_entries: maximum number of prefixes kept.
+
+    """
+    def __init__(self, limit=CITIES_RESULT_LIMIT, get_name=get_city_name,
+            ttl=REFERENCE_CACHE_TTL, max_entries=REFERENCE_CACHE_MAX_ENTRIES):
+        self.limit = limit
+        self.get_name = get_name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._prefixes = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _build(self, cities, prefix=''):
+        """Return the normalized names of the cities, sorted, with the
+        positions of the cities, or None if a name can't be read or doesn't
+        start with prefix.
+
+        """
+        entries = []
+        for position, city in enumerate(cities):
+            name = self.get_name(city)
+            if name is None:
+                return None
+            key = normalize_city_prefix(name)
+            if not key.startswith(prefix):
+                return None
+            entries.append((key, position))
+        entries.sort()
+        return ([key for key, position in entries],
+                [position for key, position in entries], list(cities))
+
+    def _store(self, prefix, built, expires):
+        self._lock.acquire()
+        try:
+            self._prefixes.pop(prefix, None)
+            self._prefixes[prefix] = (expires, built)
+            while len(self._prefixes) > self.max_entries:
+                self._prefixes.popitem(last=False)
+        finally:
+            self._lock.release()
+
+    def add(self, prefix, cities):
+        """Record the cities returned by the server for prefix, if this
+        result is complete and can be indexed.
+
+        """
+        if len(cities) >= self.limit:
+            return
+        prefix = normalize_city_prefix(prefix)
+        built = self._build(cities, prefix)
+        if built is not None:
+            self._store(prefix, built, time.time() + self.ttl)
+
+    def load(self, cities):
+        """Preload the index with all the existing cities, kept until the
+        index is cleared.
+
+        """
+        built = self._build(cities)
+        if built is None:
+            raise ValueError('The cities must all have a name')
+        self.clear()
+        self._store('', built, None)
+
+    def load_file(self, path):
+        """Preload the index with a json dump of all the cities.
+
+        """
+        f = open(path)
+        try:
+            self.load(json.load(f))
+        finally:
+            f.close()
+
+    def _find(self, prefix):
+        """Return the entry of the longest indexed prefix of prefix.
+
+        """
+        now = time.time()
+        prefixes = self._prefixes
+        for i in range(len(prefix), -1, -1):
+            entry = prefixes.pop(prefix[:i], None)
+            if entry is None:
+                continue
+            if entry[0] is not None and entry[0] <= now:
+                continue
+            prefixes[prefix[:i]] = entry
+            return entry[1]
+        return None
+
+    def lookup(self, prefix):
+        """Return the cities starting with prefix, or None if the index can't
+        tell without asking the server.
+
+        """
+        prefix = normalize_city_prefix(prefix)
+        self._lock.acquire()
+        try:
+            built = self._find(prefix)
+            if built is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        finally:
+            self._lock.release()
+        keys, positions, cities = built
+        start = end = bisect_left(keys, prefix)
+        while end < len(keys) and keys[end].startswith(prefix):
+            end += 1
+        found = sorted(positions[start:end])[:self.limit]
+        return [cities[position] for position in found]
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._prefixes.clear()
+        finally:
+            self._lock.release()
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_city_index(server_url):
+    """Return the city index shared by all the libs using server_url.
+
+    """
+    _indexes_lock.acquire()
+    try:
+        if server_url not in _indexes:
+            _indexes[server_url] = CityIndex()
+        return _indexes[server_url]
+    finally:
+        _indexes_lock.release()
@@ -0,0 +1,79 @@
+"""A single entry point to all the libs.
+
+"""
+from bv.libclient.baselib import make_oauth_filters, get_pipeline_options
+from bv.libclient.pool import get_pool
+from bv.libclient.libtrips import LibTrips
+from bv.libclient.libusers import LibUsers
+from bv.libclient.libtalks import LibTalks
+from bv.libclient.libratings import LibRatings
+
+class BvClient(object):
+    """Give access to all the libs, sharing the same credentials, connection
+    pool and caches::
+
+        client = BvClient(server_url, consumer_key, consumer_secret,
+                          token_key, token_secret)
+        client.trips.list_trips()
+        client.users.get_active_user()
+
+    Other lib classes can be built with the same shared state thanks to
+    `get_lib`. The `pool_options` and the options of the request pipeline
+    (http_cache, read_cache, retry_policy...) are the ones of BaseLib.
+
+    """
+    def __init__(self, server_url=None, consumer_key=None, consumer_secret=None,
+            token_key=None, token_secret=None, filters=None, pool=None,
+            pool_options=None, **options):
+        self.server_url = server_url
+        if filters is None:
+            filters = make_oauth_filters(consumer_key, consumer_secret,
+                    token_key, token_secret)
+        self._filters = filters
+        if pool is None:
+            pool = get_pool(server_url, **(pool_options or {}))
+        self.pool = pool
+        self.options = get_pipeline_options(options)
+        self._resources = {}
+        self._libs = {}
+
+        self.trips = self.get_lib(LibTrips)
+        self.users = self.get_lib(LibUsers)
+        self.talks = self.get_lib(LibTalks)
+        self.ratings = self.get_lib(LibRatings)
+
+    def __getattr__(self, name):
+        options = self.__dict__.get('options')
+        if options is not None and name in options:
+            return options[name]
+        raise AttributeError(name)
+
+    def get_params(self):
+        """Return the parameters shared by all the libs of this client.
+
+        """
+        return dict(self.options,
+            server_url=self.server_url,
+            filters=self._filters,
+            pool=self.pool,
+            resources=self._resources,
+        )
+
+    def get_lib(self, lib_class):
+        """Return the instance of lib_class bound to this client.
+
+        """
+        if lib_class not in self._libs:
+            self._libs[lib_class] = lib_class(**self.get_params())
+        return self._libs[lib_class]
+
+    def get_filters(self):
+        return self._filters
+
+    def set_filters(self, filters):
+        """Change the credentials of all the libs of this client.
+
+        """
+        self._filters = filters
+        for lib in self._libs.values():
+            lib.set_filters(filters)
@@ -1 +1,28 @@
 DEFAULT_PAGINATION = 20 # Display 20 items per page by default
+DEFAULT_POOL_MAX_CONNECTIONS = 10 # Idle connections kept per host
+DEFAULT_POOL_IDLE_TIMEOUT = 300 # Seconds an idle connection is kept alive
+DEFAULT_POOL_TIMEOUT = 300 # Socket timeout of the pooled connections
+DEFAULT_WORKERS = 10 # Threads used to run concurrent calls
+DEFAULT_PREFETCH = 1 # Pages fetched in advance when iterating
+DEFAULT_PAGE_RETRIES = 2 # Retries of a failed page when fetching all pages
+DEFAULT_HTTP_CACHE_MAX_ENTRIES = 1000 # Responses kept by the http cache
+DEFAULT_HTTP_CACHE_MAX_SIZE = 10 * 1024 * 1024 # Bytes kept by the http cache
+REFERENCE_CACHE_TTL = 3600 # Seconds the reference data (cartypes...) is cached
+REFERENCE_CACHE_MAX_ENTRIES = 1000 # Cached results per reference method
+CITIES_RESULT_LIMIT = 10 # Maximum number of cities returned by the server
+JSON_STREAM_CHUNK_SIZE = 16 * 1024 # Bytes read at once when streaming json
+DATE_CACHE_MAX_ENTRIES = 1024 # Converted date strings kept in memory
+BVUSER_CACHE_TTL = 300 # Seconds the active user is kept in the django session
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000) # Upper bounds (ms) of the latency histograms
+DEFAULT_RETRY_ATTEMPTS = 3 # Attempts of an idempotent request, the first included
+DEFAULT_RETRY_BACKOFF = 0.1 # Seconds waited after the first failed attempt
+DEFAULT_RETRY_MAX_BACKOFF = 2 # Maximum seconds waited between two attempts
+DEFAULT_RETRY_DEADLINE = 10 # Seconds after which no new attempt is made
+CIRCUIT_WINDOW = 60 # Seconds of calls considered by the circuit breakers
+CIRCUIT_MIN_CALLS = 20 # Calls in the window before a circuit can open
+CIRCUIT_FAILURE_RATE = 0.5 # Rate of failed calls opening a circuit
+CIRCUIT_SLOW_CALL = 5 # Seconds after which a call is slow
+CIRCUIT_SLOW_RATE = 0.8 # Rate of slow calls opening a circuit
+CIRCUIT_OPEN_TIMEOUT = 30 # Seconds a circuit stays open before a probe
+CIRCUIT_HALF_OPEN_CALLS = 1 # Concurrent probes of a half-open circuit
+SINGLE_FLIGHT_TIMEOUT = 30 # Seconds a caller waits for an identical request in flight
@@ -33,3 +33,21 @@ class InputError(BvLibClientException):
 
     """
     pass
+
+class FutureTimeout(BvLibClientException):
+    """The result of a call run in a worker pool was not available in time.
+
+    """
+    pass
+
+class CircuitOpen(ApiException):
+    """The API endpoint is failing, the call has not been made.
+
+    """
+    pass
+
+class SingleFlightTimeout(ApiException):
+    """An identical request in flight did not finish in time.
+
+    """
+    pass
@@ -9,15 +9,55 @@ Steps to follow to set up a django application:
         @inject_lib(LibCarpool)
         def my_view(request, param1, lib)
 
+    * or inject a `BvClient` to get all the libs at once, sharing the same
+    credentials and connections::
+
+        @inject_lib(BvClient)
+        def my_view(request, param1, lib):
+            lib.trips.list_trips()
+
+The consumer credentials are read from the database once per process; call
+`invalidate_consumer_credentials` when they change. Within a request, the
+libs are built once per lib class and token.
+
+The `bvuser` of the requests is only fetched when first accessed, and kept in
+the session (as a json serializable dict) for BVCLIENT_BVUSER_CACHE_TTL
+seconds (0 to disable).
+
+The libs of a request share a read cache: identical GET calls made while
+handling one request (middleware, views, template tags) hit the API once. The
+AuthenticationMiddleware clears it when the response is returned.
+
+Set BVCLIENT_CIRCUIT_BREAKERS = True to make the libs fail fast (with
+CircuitOpen) while an endpoint of the API is failing, and
+BVCLIENT_SINGLE_FLIGHT = True to make the identical GET calls of concurrent
+requests only once.
+
 """
 from django.conf import settings
+from django.utils.functional import SimpleLazyObject
 import inspect
+import threading
+import time
 from oauthclient.utils import get_consumer_token, is_oauth_authenticated, \
     need_oauth_authentication
 
-from bv.libclient.libusers import LibUsers
+from bv.libclient.libusers import LibUsers, User
+from bv.libclient.utils import dict_to_object_func, to_serializable
+from bv.libclient.httpcache import ReadCache
+from bv.libclient.circuitbreaker import get_circuit_breakers
+from bv.libclient.singleflight import get_single_flight
+from bv.libclient.constants import BVUSER_CACHE_TTL
 
 oauth_identifier = getattr(settings, 'BVCLIENT_OAUTH_APPID', 'bisonvert')
+bvuser_cache_ttl = getattr(settings, 'BVCLIENT_BVUSER_CACHE_TTL',
+        BVUSER_CACHE_TTL)
+BVUSER_SESSION_KEY = '_bvuser'
+use_circuit_breakers = getattr(settings, 'BVCLIENT_CIRCUIT_BREAKERS', False)
+use_single_flight = getattr(settings, 'BVCLIENT_SINGLE_FLIGHT', False)
+
+_consumer_credentials = {}
+_consumer_credentials_lock = threading.Lock()
 
 def is_bvoauth_authenticated(request):
     return is_oauth_authenticated(request, oauth_identifier)
@@ -35,20 +75,73 @@ def get_defaults_args(func):
     index = len(args) - len(defaults)
     return dict(zip(args[index:], defaults))
 
+def get_consumer_credentials(identifier=None):
+    """Return the (server url, key, secret) of the consumer token, cached
+    for the whole process.
+
+    """
+    if identifier is None:
+        identifier = oauth_identifier
+    credentials = _consumer_credentials.get(identifier)
+    if credentials is None:
+        token = get_consumer_token(identifier)
+        credentials = (token.server.server_url, token.key, token.secret)
+        _consumer_credentials_lock.acquire()
+        try:
+            _consumer_credentials[identifier] = credentials
+        finally:
+            _consumer_credentials_lock.release()
+    return credentials
+
+def invalidate_consumer_credentials(identifier=None):
+    """Forget the cached consumer credentials (all of them if identifier is
+    None), eg. after the consumer token has been changed.
+
+    """
+    _consumer_credentials_lock.acquire()
+    try:
+        if identifier is None:
+            _consumer_credentials.clear()
+        else:
+            _consumer_credentials.pop(identifier, None)
+    finally:
+        _consumer_credentials_lock.release()
+
+def get_read_cache(request):
+    """Return the read cache shared by the libs of a request.
+
+    """
+    read_cache = getattr(request, '_bvreadcache', None)
+    if read_cache is None:
+        read_cache = request._bvreadcache = ReadCache()
+    return read_cache
+
 def get_lib(lib, request):
     """Return a lib initialized with oauth_token and oauth_token_secret
-    
+
+    The lib is built once per request, lib class and token.
     """
-    token = get_consumer_token(oauth_identifier)
+    server_url, consumer_key, consumer_secret = get_consumer_credentials()
     kwargs = {
-        'server_url': token.server.server_url,
-        'consumer_key': token.key,
-        'consumer_secret': token.secret,
+        'server_url': server_url,
+        'consumer_key': consumer_key,
+        'consumer_secret': consumer_secret,
+        'read_cache': get_read_cache(request),
     }
+    if use_circuit_breakers:
+        kwargs['circuit_breakers'] = get_circuit_breakers(server_url)
+    if use_single_flight:
+        kwargs['single_flight'] = get_single_flight()
     if is_oauth_authenticated(request, oauth_identifier):
         kwargs['token_key'] = request.session[oauth_identifier + '_oauth_token']
         kwargs['token_secret'] = request.session[oauth_identifier + '_oauth_token_secret']
-    return lib(**kwargs)
+    libs = getattr(request, '_bvlibs', None)
+    if libs is None:
+        libs = request._bvlibs = {}
+    key = (lib, kwargs.get('token_key'), kwargs.get('token_secret'))
+    if key not in libs:
+        libs[key] = lib(**kwargs)
+    return libs[key]
     
 def inject_lib(lib):
     """If lib is specified, inject the lib as last function argument.
@@ -73,35 +166,77 @@ def inject_lib(lib):
         return wrapped
     return wrapper
 
+def get_bvuser(request):
+    """Return the API user of the request, from the session if it has been
+    cached for the current token, or None if not authenticated.
+
+    """
+    if not is_oauth_authenticated(request, oauth_identifier):
+        return None
+    token_key = request.session[oauth_identifier + '_oauth_token']
+    cached = request.session.get(BVUSER_SESSION_KEY)
+    if cached is not None:
+        cached_token_key, expires, data = cached
+        if cached_token_key == token_key and expires > time.time():
+            return dict_to_object_func(data, User)
+    try:
+        user = get_lib(LibUsers, request).get_active_user()
+    except Exception:
+        return None
+    if bvuser_cache_ttl and user is not None:
+        # the sessions may be serialized in json: keep no object in there
+        request.session[BVUSER_SESSION_KEY] = [token_key,
+                time.time() + bvuser_cache_ttl, to_serializable(user)]
+    return user
+
+def set_lazy_bvuser(request):
+    """Give the request a `bvuser` only fetched when first accessed, or
+    None if the request is not authenticated.
+
+    The lazy object is always true, so it is only used when there is a token
+    (checking it only reads the session).
+    """
+    if is_oauth_authenticated(request, oauth_identifier):
+        request.bvuser = SimpleLazyObject(lambda: get_bvuser(request))
+    else:
+        request.bvuser = None
+
+def invalidate_bvuser(request):
+    """Forget the API user of the request, eg. after it has been edited.
+
+    """
+    request.session.pop(BVUSER_SESSION_KEY, None)
+    if hasattr(request, 'bvuser'):
+        set_lazy_bvuser(request)
+
 class AuthenticationMiddleware(object):
     def process_request(self, request):
         """If some information are available in session about oauth token, 
         try to use it to authenticate to the BisonVert API, and provides a user
         in the request, as the `bvuser` parameter.
 
+        The user is only fetched when `request.bvuser` is first accessed;
+        `request.bvuser` is None if the session holds no token.
         """
-        if is_oauth_authenticated(request, oauth_identifier):
-            try:
-                lib = get_lib(LibUsers, request)
-                request.__class__.bvuser = lib.get_active_user()
-            except Exception:
-                request.__class__.bvuser = None
-        else:
-            request.__class__.bvuser = None
+        set_lazy_bvuser(request)
         return None
 
+    def process_response(self, request, response):
+        """Forget the API responses read while handling the request.
+
+        """
+        read_cache = getattr(request, '_bvreadcache', None)
+        if read_cache is not None:
+            read_cache.clear()
+        return response
+
 def bvauth(request):
     """Add `bvuser` to the context, if the user is logged in (determined by 
     the AuthenticationMiddleware from bv.libclient.ext.dj.
     
     If there is no `bvuser` attribute in the request, add `None` instead.
+    The user is still only fetched if the templates use it.
     """
-    def get_user():
-        if hasattr(request, 'bvuser'):
-            return request.bvuser
-        else:
-            return None
-    
     return {
-        'bvuser': get_user(),
+        'bvuser': getattr(request, 'bvuser', None),
     }
@@ -0,0 +1,303 @@
+"""HTTP conditional-request cache for the GET calls.
+
+Responses carrying an ETag or a Last-Modified validator are stored; the next
+GET on the same url sends If-None-Match / If-Modified-Since, and a 304 answer
+is served from the stored body::
+
+    cache = HttpCache(MemoryStorage(max_entries=500))
+    lib = LibTrips(server_url, http_cache=cache)
+
+A ReadCache, meant to live for a short scope like one django request, serves
+the identical GETs without asking the server at all.
+
+"""
+import os
+import threading
+import cPickle as pickle
+from collections import OrderedDict
+from hashlib import sha1
+from StringIO import StringIO
+
+from bv.libclient.constants import DEFAULT_HTTP_CACHE_MAX_ENTRIES, \
+        DEFAULT_HTTP_CACHE_MAX_SIZE
+
+class CachedResponse(object):
+    """A response whose body has already been read, mimicking the restkit
+    responses used by the libs.
+
+    """
+    def __init__(self, status_int, headers, body):
+        self.status_int = status_int
+        self.status = str(status_int)
+        self.headers = headers
+        self.body = body
+
+    def __getitem__(self, key):
+        return self.headers[key.lower()]
+
+    def __contains__(self, key):
+        return key.lower() in self.headers
+
+    def body_string(self, charset=None, unicode_errors="strict"):
+        if charset is not None:
+            try:
+                return self.body.decode(charset, unicode_errors)
+            except UnicodeDecodeError:
+                pass
+        return self.body
+
+    def body_stream(self):
+        return StringIO(self.body)
+
+    def close(self):
+        pass
+
+class CacheEntry(object):
+    """A stored body and its validators.
+
+    """
+    def __init__(self, headers, body):
+        self.headers = headers
+        self.body = body
+        self.etag = headers.get('etag')
+        self.last_modified = headers.get('last-modified')
+
+    def __len__(self):
+        return len(self.body)
+
+    def get_validation_headers(self):
+        headers = []
+        if self.etag:
+            headers.append(('If-None-Match', self.etag))
+        if self.last_modified:
+            headers.append(('If-Modified-Since', self.last_modified))
+        return headers
+
+    def get_response(self):
+        return CachedResponse(200, self.headers, self.body)
+
+class MemoryStorage(object):
+    """Keep the entries in memory, evicting the least recently used ones
+    when there are more than max_entries or the bodies are bigger than
+    max_size bytes.
+
+    """
+    def __init__(self, max_entries=DEFAULT_HTTP_CACHE_MAX_ENTRIES,
+            max_size=DEFAULT_HTTP_CACHE_MAX_SIZE):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+        finally:
+            self._lock.release()
+
+    def set(self, key, entry):
+        if len(entry) > self.max_size:
+            return
+        self._lock.acquire()
+        try:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = entry
+            self.size += len(entry)
+            while len(self._entries) > self.max_entries \
+                    or self.size > self.max_size:
+                key, old = self._entries.popitem(last=False)
+                self.size -= len(old)
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self.size = 0
+        finally:
+            self._lock.release()
+
+class FileStorage(object):
+    """Keep the entries as files in a directory, removing the least recently
+    written ones when there are more than max_entries.
+
+    """
+    def __init__(self, directory, max_entries=DEFAULT_HTTP_CACHE_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _get_path(self, key):
+        return os.path.join(self.directory,
+                '%s.cache' % sha1(repr(key)).hexdigest())
+
+    def _get_files(self):
+        return [os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+                if name.endswith('.cache')]
+
+    def get(self, key):
+        try:
+            f = open(self._get_path(key), 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                stored_key, entry = pickle.load(f)
+            except Exception:
+                return None
+        finally:
+            f.close()
+        if stored_key != key:
+            return None
+        return entry
+
+    def set(self, key, entry):
+        self._lock.acquire()
+        try:
+            path = self._get_path(key)
+            tmp_path = '%s.%s.%s.tmp' % (path, os.getpid(),
+                    threading.currentThread().ident)
+            f = open(tmp_path, 'wb')
+            try:
+                pickle.dump((key, entry), f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(tmp_path, path)
+            files = self._get_files()
+            if len(files) > self.max_entries:
+                files.sort(key=os.path.getmtime)
+                for path in files[:len(files) - self.max_entries]:
+                    os.remove(path)
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        try:
+            os.remove(self._get_path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            for path in self._get_files():
+                os.remove(path)
+        finally:
+            self._lock.release()
+
+class HttpCache(object):
+    """Conditional-request cache, storing the entries in a pluggable storage
+    (MemoryStorage by default).
+
+    """
+    def __init__(self, storage=None):
+        if storage is None:
+            storage = MemoryStorage()
+        self.storage = storage
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the stored entry of key, counting a miss if there is none.
+
+        """
+        entry = self.storage.get(key)
+        if entry is None:
+            self.misses += 1
+        return entry
+
+    def store(self, key, response):
+        """Store the response if it has validators, and return a response
+        that can still be read.
+
+        """
+        headers = dict(response.headers)
+        if not ('etag' in headers or 'last-modified' in headers):
+            return response
+        entry = CacheEntry(headers, response.body_string())
+        self.storage.set(key, entry)
+        return entry.get_response()
+
+    def revalidated(self, entry):
+        """Return the stored response of an entry the server validated.
+
+        """
+        self.hits += 1
+        return entry.get_response()
+
+    def get_stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def clear(self):
+        self.storage.clear()
+
+class ReadCache(object):
+    """Keep the successful GET responses, and serve them again without any
+    request. Any other request made through the cache clears it.
+
+    The responses are never revalidated: only use it for a short scope, like
+    the handling of one django request.
+
+    """
+    def __init__(self):
+        self._responses = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._responses.get(key)
+        if entry is None:
+            return None
+        self.hits += 1
+        return CachedResponse(*entry)
+
+    def store(self, key, response):
+        """Store the response, and return a response that can still be read.
+
+        """
+        self.misses += 1
+        entry = (response.status_int, dict(response.headers),
+                response.body_string())
+        self._lock.acquire()
+        try:
+            self._responses[key] = entry
+        finally:
+            self._lock.release()
+        return CachedResponse(*entry)
+
+    def get_stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._responses.clear()
+        finally:
+            self._lock.release()
@@ -0,0 +1,320 @@
+"""Hooks called after every request made to the API.
+
+A hook is a callable receiving a RequestEvent as soon as the headers of the
+response are received (or the request has failed), so the requests whose
+body is never read are reported too::
+
+    stats = RequestStats()
+    add_hook(stats)
+    ...
+    stats.get_stats()['trip']['histogram']
+
+When no hook is registered, the requests are not instrumented at all.
+
+"""
+import os
+import time
+import threading
+
+from restkit.forms import form_encode
+
+from bv.libclient.constants import LATENCY_BUCKETS
+
+# the registered hooks; only modified in place, so it can be imported
+hooks = []
+_hooks_lock = threading.Lock()
+
+def add_hook(hook):
+    _hooks_lock.acquire()
+    try:
+        if hook not in hooks:
+            hooks.append(hook)
+    finally:
+        _hooks_lock.release()
+
+def remove_hook(hook):
+    _hooks_lock.acquire()
+    try:
+        if hook in hooks:
+            hooks.remove(hook)
+    finally:
+        _hooks_lock.release()
+
+def get_payload_size(payload):
+    """Return the number of bytes restkit sends for a request payload: the
+    form encoding of dicts, the length of strings and files.
+
+    """
+    if payload is None:
+        return 0
+    if isinstance(payload, dict):
+        payload = form_encode(payload)
+    if isinstance(payload, unicode):
+        payload = payload.encode('utf-8')
+    if isinstance(payload, str):
+        return len(payload)
+    if hasattr(payload, 'fileno'):
+        return os.fstat(payload.fileno()).st_size
+    if hasattr(payload, 'getvalue'):
+        return len(payload.getvalue())
+    return 0
+
+class RequestEvent(object):
+    """What happened during a request.
+
+    `time_to_headers` and `total_time` are in seconds; `status` and
+    `time_to_headers` are None if the request failed before the server
+    answered. `bytes_out` is the size of the encoded payload.
+
+    The body is read after the hooks have been called: `bytes_in` counts the
+    bytes read so far, `body_time` (the seconds spent between the headers
+    and the end of the body) is None until the body has been read or the
+    response closed, and `total_time` is only the time to headers until
+    then. Hooks needing them register a callback with add_body_callback.
+
+    """
+    def __init__(self, endpoint, method, url, path=None, payload=None):
+        self.endpoint = endpoint
+        self.method = method
+        self.url = url
+        self.path = path
+        self.bytes_out = get_payload_size(payload)
+        self.bytes_in = 0
+        self.status = None
+        self.time_to_headers = None
+        self.total_time = None
+        self.body_time = None
+        self.exception = None
+        self.start = time.time()
+        self._finished = False
+        self._body_read = False
+        self._body_callbacks = []
+
+    def headers_received(self, status):
+        """Record the time to headers and call the hooks.
+
+        """
+        self.status = status
+        self.time_to_headers = time.time() - self.start
+        self.finish()
+
+    def finish(self, exception=None):
+        """Compute the total time and call the hooks, only once.
+
+        """
+        if self._finished:
+            return
+        self._finished = True
+        self.total_time = time.time() - self.start
+        if exception is not None:
+            self.exception = exception
+            if self.status is None:
+                # the restkit errors carry the status of the response
+                self.status = getattr(exception, 'status_int', None)
+        for hook in list(hooks):
+            try:
+                hook(self)
+            except Exception:
+                # observers must never break the requests
+                pass
+
+    def add_body_callback(self, callback):
+        """Call callback with the event once the body has been read.
+
+        """
+        if self._body_read:
+            callback(self)
+        else:
+            self._body_callbacks.append(callback)
+
+    def body_read(self, exception=None):
+        """Compute the body and total times and call the body callbacks,
+        only once.
+
+        """
+        if self._body_read:
+            return
+        self._body_read = True
+        self.total_time = time.time() - self.start
+        self.body_time = self.total_time - self.time_to_headers
+        if exception is not None:
+            self.exception = exception
+        for callback in self._body_callbacks:
+            try:
+                callback(self)
+            except Exception:
+                pass
+        self._body_callbacks = []
+
+class InstrumentedStream(object):
+    """Count the bytes read from a response stream.
+
+    """
+    def __init__(self, stream, event):
+        self.stream = stream
+        self.event = event
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.event.bytes_in += len(data)
+        if not data or size is None or size < 0:
+            self.event.body_read()
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class InstrumentedResponse(object):
+    """Proxy of a response, completing its event once the body is read.
+
+    """
+    def __init__(self, response, event):
+        self._response = response
+        self._event = event
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __getitem__(self, key):
+        return self._response[key]
+
+    def __contains__(self, key):
+        return key in self._response
+
+    def body_string(self, *args, **kwargs):
+        try:
+            body = self._response.body_string(*args, **kwargs)
+        except Exception as e:
+            self._event.body_read(e)
+            raise
+        self._event.bytes_in += len(body)
+        self._event.body_read()
+        return body
+
+    def body_stream(self):
+        return InstrumentedStream(self._response.body_stream(), self._event)
+
+    def close(self):
+        try:
+            self._response.close()
+        finally:
+            self._event.body_read()
+
+class RequestStats(object):
+    """A hook aggregating, per endpoint, the number of requests and errors,
+    the bytes transferred and histograms of the times.
+
+    The histograms count the requests under each bound of `buckets` (in
+    milliseconds), the last count being for the slower ones.
+    `headers_histogram` holds the times to headers of all the answered
+    requests. `histogram`, `mean_time` and `max_time` are about the total
+    times (body included) of the `completed` requests: the ones whose body
+    has been read or closed, and the failed ones.
+
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def _new_endpoint(self):
+        return {
+            'count': 0,
+            'errors': 0,
+            'bytes_in': 0,
+            'bytes_out': 0,
+            'completed': 0,
+            'total_time': 0.0,
+            'max_time': 0.0,
+            'histogram': [0] * (len(self.buckets) + 1),
+            'headers_histogram': [0] * (len(self.buckets) + 1),
+        }
+
+    def _get_bucket(self, elapsed):
+        for i, bound in enumerate(self.buckets):
+            if elapsed <= bound:
+                return i
+        return len(self.buckets)
+
+    def _record_total(self, stats, event):
+        elapsed = event.total_time * 1000
+        stats['completed'] += 1
+        stats['total_time'] += elapsed
+        stats['max_time'] = max(stats['max_time'], elapsed)
+        stats['histogram'][self._get_bucket(elapsed)] += 1
+
+    def __call__(self, event):
+        self._lock.acquire()
+        try:
+            stats = self._endpoints.get(event.endpoint)
+            if stats is None:
+                stats = self._endpoints[event.endpoint] = self._new_endpoint()
+            stats['count'] += 1
+            stats['bytes_out'] += event.bytes_out
+            if event.time_to_headers is not None:
+                stats['headers_histogram'][self._get_bucket(
+                    event.time_to_headers * 1000)] += 1
+            if event.exception is not None:
+                stats['errors'] += 1
+                self._record_total(stats, event)
+        finally:
+            self._lock.release()
+        if event.exception is None:
+            event.add_body_callback(self._body_read)
+
+    def _body_read(self, event):
+        self._lock.acquire()
+        try:
+            stats = self._endpoints.get(event.endpoint)
+            if stats is None:
+                # reset since the headers were received
+                return
+            if event.exception is not None:
+                stats['errors'] += 1
+            stats['bytes_in'] += event.bytes_in
+            self._record_total(stats, event)
+        finally:
+            self._lock.release()
+
+    def get_percentile(self, endpoint, percentile):
+        """Return the bound (in ms) under which percentile % of the completed
+        requests to endpoint took, or None for the slowest bucket.
+
+        """
+        stats = self.get_stats().get(endpoint)
+        if not stats or not stats['completed']:
+            return None
+        threshold = stats['completed'] * percentile / 100.0
+        seen = 0
+        for bound, count in zip(self.buckets, stats['histogram']):
+            seen += count
+            if seen >= threshold:
+                return bound
+        return None
+
+    def get_stats(self):
+        """Return the stats of each endpoint, with the mean total time in ms
+        (None if no request is completed).
+
+        """
+        self._lock.acquire()
+        try:
+            result = {}
+            for endpoint, stats in self._endpoints.items():
+                stats = dict(stats, histogram=list(stats['histogram']),
+                        headers_histogram=list(stats['headers_histogram']))
+                stats['mean_time'] = None
+                if stats['completed']:
+                    stats['mean_time'] = stats['total_time'] / \
+                            stats['completed']
+                result[endpoint] = stats
+            return result
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self._endpoints.clear()
+        finally:
+            self._lock.release()
@@ -0,0 +1,86 @@
+"""The json codec used by all the libs.
+
+The fastest installed backend among ujson, simplejson and the standard json
+module is picked on import; use `set_backend` to choose another one, or
+`register_backend` to add one.
+
+"""
+import json
+
+class JsonBackend(object):
+    def __init__(self, name, loads, dumps):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+    def __repr__(self):
+        return '<JsonBackend %s>' % self.name
+
+def _load_ujson():
+    import ujson
+    return JsonBackend('ujson', ujson.loads, ujson.dumps)
+
+def _load_simplejson():
+    import simplejson
+    return JsonBackend('simplejson', simplejson.loads, simplejson.dumps)
+
+def _load_json():
+    return JsonBackend('json', json.loads, json.dumps)
+
+# backend loaders, by order of preference
+_loaders = [
+    ('ujson', _load_ujson),
+    ('simplejson', _load_simplejson),
+    ('json', _load_json),
+]
+_backend = None
+
+def register_backend(name, loads, dumps, preferred=True):
+    """Make a new backend available, first or last by order of preference.
+
+    """
+    loader = lambda: JsonBackend(name, loads, dumps)
+    if preferred:
+        _loaders.insert(0, (name, loader))
+    else:
+        _loaders.append((name, loader))
+
+def get_available_backends():
+    """Return the installed backends, by order of preference.
+
+    """
+    backends = []
+    for name, loader in _loaders:
+        try:
+            backends.append(loader())
+        except ImportError:
+            pass
+    return backends
+
+def set_backend(name=None):
+    """Use the named backend, or the preferred installed one if name is None.
+
+    """
+    global _backend
+    for backend in get_available_backends():
+        if name is None or backend.name == name:
+            _backend = backend
+            return backend
+    raise ValueError('The json backend %r is not available' % name)
+
+def get_backend():
+    return _backend
+
+def loads(value):
+    """Decode a json string with the current backend.
+
+    """
+    return _backend.loads(value)
+
+def dumps(value):
+    """Encode a value to json with the current backend.
+
+    """
+    return _backend.dumps(value)
+
+set_backend()
@@ -0,0 +1,161 @@
+"""Incremental decoding of json responses.
+
+The body is read chunk by chunk from the response stream, and the items of
+the top level array (or of the arrays of the top level object) are decoded
+and yielded one by one, so the whole body and the whole decoded tree are
+never held in memory at once.
+
+"""
+import json
+from StringIO import StringIO
+
+from bv.libclient.constants import JSON_STREAM_CHUNK_SIZE
+
+WHITESPACES = ' \t\n\r'
+NUMBER_CHARS = '0123456789+-.eE'
+
+class JsonStreamReader(object):
+    """Decode json values from a file-like object.
+
+    """
+    def __init__(self, stream, chunk_size=JSON_STREAM_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self):
+        """Append a new chunk to the buffer, dropping the consumed part.
+
+        Return False if the stream is exhausted.
+
+        """
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non whitespace character, or '' at the end.
+
+        """
+        while True:
+            buffer, pos = self.buffer, self.pos
+            while pos < len(buffer) and buffer[pos] in WHITESPACES:
+                pos += 1
+            self.pos = pos
+            if pos < len(buffer):
+                return buffer[pos]
+            if not self.read_more():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expecting %r at position %d of the json stream'
+                    % (char, self.pos))
+        self.pos += 1
+
+    def is_truncated(self, end):
+        """Return True if the value decoded up to end may continue in the
+        next chunk: a number cut at the end of the buffer, possibly right
+        after its '.' or 'e' (which raw_decode leaves out of the number).
+
+        """
+        buffer = self.buffer
+        while end < len(buffer):
+            if buffer[end] not in NUMBER_CHARS:
+                return False
+            end += 1
+        return True
+
+    def decode(self):
+        """Decode the next json value.
+
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                # the value is not complete yet
+                if not self.read_more():
+                    raise
+                continue
+            if self.is_truncated(end) and self.read_more():
+                continue
+            self.pos = end
+            return value
+
+    def iter_array(self):
+        """Yield the items of the array starting at the current position.
+
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect(']')
+                return
+
+def get_response_stream(resp):
+    """Return a file-like object to read the body of a response.
+
+    """
+    if hasattr(resp, 'body_stream'):
+        return resp.body_stream()
+    if hasattr(resp, 'read'):
+        return resp
+    return StringIO(resp)
+
+def iter_json_array(resp, chunk_size=JSON_STREAM_CHUNK_SIZE):
+    """Yield the decoded items of the json array in the response body.
+
+    """
+    try:
+        reader = JsonStreamReader(get_response_stream(resp), chunk_size)
+        for item in reader.iter_array():
+            yield item
+    finally:
+        if hasattr(resp, 'close'):
+            resp.close()
+
+def iter_json_object(resp, array_keys=(), chunk_size=JSON_STREAM_CHUNK_SIZE):
+    """Yield (key, value) pairs for the json object in the response body.
+
+    The arrays under array_keys are not decoded at once: a (key, item) pair
+    is yielded for each of their items instead.
+
+    """
+    try:
+        reader = JsonStreamReader(get_response_stream(resp), chunk_size)
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            key = reader.decode()
+            reader.expect(':')
+            if key in array_keys and reader.peek() == '[':
+                for item in reader.iter_array():
+                    yield key, item
+            else:
+                yield key, reader.decode()
+            if reader.peek() == ',':
+                reader.pos += 1
+            else:
+                reader.expect('}')
+                return
+    finally:
+        if hasattr(resp, 'close'):
+            resp.close()
@@ -4,7 +4,8 @@ from bv.libclient.utils import json_unpack, ApiObject, dict_to_object, \
 
 from bv.libclient.libtrips import Trip
 from bv.libclient.libusers import User
-from bv.libclient.constants import DEFAULT_PAGINATION
+from bv.libclient.constants import DEFAULT_PAGINATION, DEFAULT_PREFETCH, \
+        DEFAULT_WORKERS, DEFAULT_PAGE_RETRIES
 from bv.libclient.exceptions import *
 
 class Talk(ApiObject):
@@ -12,12 +13,14 @@ class Talk(ApiObject):
         'trip': Trip, 
         'from_user': User,
     }
+    _lazy_hydration = True
 
 class Message(ApiObject):
     _class_keys = {
         'talk' : Talk,
     }
     clean_date = staticmethod(api_to_datetime)
+    _lazy_hydration = True
 
     @property
     def user(self):
@@ -49,6 +52,24 @@ class LibTalks(BaseLib):
         return  self.get_resource('talks').get(
                 **self._get_pagination_params(page,count))
 
+    def iter_talks(self, count=DEFAULT_PAGINATION, prefetch=DEFAULT_PREFETCH,
+            ordered_by='date'):
+        """Iterate over all the talks of the authenticated user, fetching
+        `count` talks per page and `prefetch` pages in advance.
+
+        """
+        return self._iter_pages(self.list_talks, count, prefetch,
+                ordered_by=ordered_by)
+
+    def fetch_all_talks(self, workers=DEFAULT_WORKERS, count=DEFAULT_PAGINATION,
+            retries=DEFAULT_PAGE_RETRIES, ordered_by='date'):
+        """Return all the talks of the authenticated user, fetching the pages
+        concurrently with `workers` threads.
+
+        """
+        return self._fetch_all(self.list_talks, self.count_talks, count,
+                workers, retries, ordered_by=ordered_by)
+
     def count_talks(self):
         """Count the number of talks
         
@@ -0,0 +1,68 @@
+"""Threaded flavour of the libs: API calls run in a pool of threads.
+
+Each API method of a threaded lib is submitted to a worker pool and
+immediately returns a `Future`; the result is the same object the
+synchronous lib would have returned::
+
+    lib = ThreadedLibTrips(server_url)
+    futures = [lib.get_trip(trip_id) for trip_id in trip_ids]
+    trips = wait_all(futures)
+
+This is not a non-blocking transport: each call is a blocking request that
+holds one thread of the pool for its whole duration. The default pool shared
+by the libs has DEFAULT_WORKERS (10) threads, so at most 10 calls are in
+flight at once, the other ones waiting in its queue. Pass
+`workers=WorkerPool(size)` to allow more, at the cost of one thread per
+concurrent call.
+
+"""
+from bv.libclient.baselib import BaseLib
+from bv.libclient.workers import get_worker_pool
+from bv.libclient.libtrips import LibTrips
+from bv.libclient.libusers import LibUsers
+from bv.libclient.libtalks import LibTalks
+from bv.libclient.libratings import LibRatings
+
+class ThreadedLib(object):
+    """Wrap a synchronous lib and run its API methods in a pool of threads.
+
+    Accept the same arguments as the wrapped lib, and an optional `workers`
+    pool (by default the shared one, of DEFAULT_WORKERS threads). Methods
+    inherited from BaseLib (get_resource, set_filters...), iterators and
+    private ones stay synchronous.
+
+    """
+    lib_class = BaseLib
+    _sync_prefixes = ('_', 'iter_')
+
+    def __init__(self, *args, **kwargs):
+        workers = kwargs.pop('workers', None)
+        if workers is None:
+            workers = get_worker_pool()
+        self.workers = workers
+        self.lib = self.lib_class(*args, **kwargs)
+
+    def __getattr__(self, name):
+        attr = getattr(self.lib, name)
+        if name.startswith(self._sync_prefixes) or hasattr(BaseLib, name) \
+                or not callable(attr):
+            return attr
+        def method(*args, **kwargs):
+            return self.workers.submit(attr, *args, **kwargs)
+        method.__name__ = name
+        method.__doc__ = attr.__doc__
+        # cache the wrapper, so the lookup is done only once
+        setattr(self, name, method)
+        return method
+
+class ThreadedLibTrips(ThreadedLib):
+    lib_class = LibTrips
+
+class ThreadedLibUsers(ThreadedLib):
+    lib_class = LibUsers
+
+class ThreadedLibTalks(ThreadedLib):
+    lib_class = LibTalks
+
+class ThreadedLibRatings(ThreadedLib):
+    lib_class = LibRatings
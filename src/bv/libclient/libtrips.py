@@ -3,18 +3,20 @@ from bv.libclient.baselib import BaseLib
 from bv.libclient.utils import ApiObject, json_unpack, date_to_api, api_to_date, \
          api_to_time, dict_to_object, dict_to_object_list, unicode_to_dict, \
          is_iterable, dict_to_object_list_func, dict_to_object_func, \
-         api_to_datetime
+         api_to_datetime, memoize, IdentityMap
 from bv.libclient.exceptions import ResourceAccessForbidden, ResourceDoesNotExist, \
     EditTripFormError
 from bv.libclient.libusers import User
-from bv.libclient.constants import DEFAULT_PAGINATION
+from bv.libclient.cities import get_city_index
+from bv.libclient.jsonstream import iter_json_object
+from bv.libclient.jsoncodec import loads as json_loads
+from bv.libclient.constants import DEFAULT_PAGINATION, DEFAULT_PREFETCH, \
+        DEFAULT_WORKERS, DEFAULT_PAGE_RETRIES, REFERENCE_CACHE_TTL, \
+        REFERENCE_CACHE_MAX_ENTRIES
 
 from restkit.errors import RequestFailed
 from restkit.util import url_encode
 
-# Python imports
-import json
-
 TRIP_OFFER = 0
 TRIP_DEMAND = 1
 TRIP_BOTH = 2
@@ -28,12 +30,15 @@ def format_dict2str(kwargs):
 
 # Model Objects
 class Offer(ApiObject):
+    _fields = ('id', 'steps', 'radius', 'route', 'car_type', 'car_seats',
+        'car_model', 'car_price', 'car_description')
+
     @property
     def checkpoints(self):
         return self.steps
 
 class Demand(ApiObject):
-    pass
+    _fields = ('id', 'radius', 'car_type')
 
 class Trip(ApiObject):
     """Represents a python Trip object, to be manipulated by python views
@@ -44,6 +49,12 @@ class Trip(ApiObject):
         'offer': Offer,
         'demand': Demand,
     }
+    _fields = ('id', 'name', 'departure_city', 'departure_address',
+        'departure_point', 'arrival_city', 'arrival_address', 'arrival_point',
+        'date', 'time', 'dows', 'interval_min', 'interval_max', 'regular',
+        'alert', 'comment', 'user', 'offer', 'demand', 'creation_date',
+        'modification_date')
+    _lazy_hydration = True
     clean_date = staticmethod(api_to_date)
     clean_time = staticmethod(api_to_time)
     clean_creation_date = staticmethod(api_to_datetime)
@@ -97,6 +108,9 @@ class LibTrips(BaseLib):
         'calculate_buffer': '/gis/calculate_buffer/',
         'ogcserver': '/gis/ogcserver/',
     }
+    # set use_city_index to False to always query the server for cities.
+    use_city_index = True
+    city_index = None
     
     def _transform_dows(self, kwargs):
         """Serialize the dows
@@ -114,6 +128,24 @@ class LibTrips(BaseLib):
         """
         return self.get_resource('trip').get(**self._get_pagination_params(page, count))
     
+    def iter_trips(self, count=DEFAULT_PAGINATION, prefetch=DEFAULT_PREFETCH,
+            ordered_by='date'):
+        """Iterate over all the trips, fetching `count` trips per page and
+        `prefetch` pages in advance.
+
+        """
+        return self._iter_pages(self.list_trips, count, prefetch,
+                ordered_by=ordered_by)
+
+    def fetch_all_trips(self, workers=DEFAULT_WORKERS, count=DEFAULT_PAGINATION,
+            retries=DEFAULT_PAGE_RETRIES, ordered_by='date'):
+        """Return all the trips, fetching the pages concurrently with
+        `workers` threads.
+
+        """
+        return self._fetch_all(self.list_trips, self.count_trips, count,
+                workers, retries, ordered_by=ordered_by)
+
     def count_trips(self):
         """return the number of trips registered on the server.
         
@@ -128,6 +160,13 @@ class LibTrips(BaseLib):
         """
         return self.get_resource('trip').get(path='%s/' % trip_id)
 
+    def get_trips(self, trip_ids, workers=DEFAULT_WORKERS):
+        """Return a dict mapping each trip id to its trip, fetched
+        concurrently. Missing trips are mapped to a ResourceDoesNotExist.
+
+        """
+        return self._get_many(self.get_trip, trip_ids, workers)
+
     @dict_to_object(Trip)
     @json_unpack()  
     def add_trip(self, **kwargs):
@@ -152,6 +191,25 @@ class LibTrips(BaseLib):
         return self.get_resource('trip').get(path='mine/', **self._get_pagination_params(page, count))
     
 
+    def iter_user_trips(self, count=DEFAULT_PAGINATION,
+            prefetch=DEFAULT_PREFETCH, ordered_by='date'):
+        """Iterate over all the user trips, fetching `count` trips per page
+        and `prefetch` pages in advance.
+
+        """
+        return self._iter_pages(self.list_user_trips, count, prefetch,
+                ordered_by=ordered_by)
+
+    def fetch_all_user_trips(self, workers=DEFAULT_WORKERS,
+            count=DEFAULT_PAGINATION, retries=DEFAULT_PAGE_RETRIES,
+            ordered_by='date'):
+        """Return all the user trips, fetching the pages concurrently with
+        `workers` threads.
+
+        """
+        return self._fetch_all(self.list_user_trips, self.count_user_trips,
+                count, workers, retries, ordered_by=ordered_by)
+
     def edit_trip(self, trip_id, **kwargs):
         """Send new informations about the trip to the API, and return the right
         response/error.
@@ -160,9 +218,9 @@ class LibTrips(BaseLib):
         kwargs = self._transform_dows(kwargs)
         response = self.get_resource('trip').put(path='%s/' % trip_id, payload=format_dict2str(kwargs))
         if response.status_int == 200:
-            return dict_to_object_func(json.loads(response.body_string()), Trip)
+            return dict_to_object_func(json_loads(response.body_string()), Trip)
         else:
-            raise EditTripFormError(json.loads(response.body_string()))
+            raise EditTripFormError(json_loads(response.body_string()))
     
     def set_alert(self, trip_id, value):
         """Change the value of the alert for a specific trip.
@@ -183,19 +241,39 @@ class LibTrips(BaseLib):
         """
         temp_results = self._search_trip(**kwargs)
         object = Trip
+        identity_map = self.identity_map
+        if identity_map is None:
+            identity_map = IdentityMap()
 
         return_dict = {}
         for key, value in temp_results.items():
             if key in ('trip_demands', 'trip_offers'):
                 if value:
-                    realvalue = [dict_to_object_func(dict, object) for dict in value]
+                    realvalue = [dict_to_object_func(dict, object, identity_map)
+                            for dict in value]
                 else:
                     realvalue = []
             elif key == 'trip':
-                realvalue = dict_to_object_func(value, object)
+                realvalue = dict_to_object_func(value, object, identity_map)
             return_dict[key] = realvalue
         return return_dict
     
+    def iter_search_trip(self, **kwargs):
+        """Same as search_trip, but decode the response incrementally and
+        yield (key, trip) pairs, key being 'trip', 'trip_offers' or
+        'trip_demands'.
+
+        """
+        resp = self._search_trip.raw(self, **kwargs)
+        identity_map = self.identity_map
+        if identity_map is None:
+            identity_map = IdentityMap()
+        for key, value in iter_json_object(resp, ('trip_offers', 'trip_demands')):
+            if key in ('trip', 'trip_offers', 'trip_demands'):
+                trip = dict_to_object_func(value, Trip, identity_map)
+                if trip is not None:
+                    yield key, trip
+
     @json_unpack()
     def _search_trip(self, **kwargs):
         """Find a trip using criterias. 
@@ -223,10 +301,31 @@ class LibTrips(BaseLib):
         # will trigger the server to search the trip
         return self.get_resource('search').get(**kwargs)
     
-    @json_unpack()
     def get_cities(self, value):
+        """Return the cities starting with value.
+
+        Complete results are kept in the city index of the server, which
+        answers the longer prefixes without querying the server.
+
+        """
+        index = self.city_index
+        if index is None and self.use_city_index:
+            index = self.city_index = get_city_index(self.server_url)
+        if index is not None:
+            cities = index.lookup(value)
+            if cities is not None:
+                return cities
+        cities = self._get_cities(value)
+        if index is not None:
+            index.add(value, cities)
+        return cities
+
+    @memoize(REFERENCE_CACHE_TTL, REFERENCE_CACHE_MAX_ENTRIES)
+    @json_unpack()
+    def _get_cities(self, value):
         return self.get_resource('city').get(path='%s/' % value.replace(' ', '-'))
     
+    @memoize(REFERENCE_CACHE_TTL, REFERENCE_CACHE_MAX_ENTRIES)
     @dict_to_object_list(CarType)
     @json_unpack()
     def get_cartypes(self):
@@ -235,6 +334,7 @@ class LibTrips(BaseLib):
         """
         return self.get_resource('cartypes').get()
 
+    @memoize(REFERENCE_CACHE_TTL, REFERENCE_CACHE_MAX_ENTRIES)
     @json_unpack()
     def calculate_buffer(self, params):
         return self.get_resource('calculate_buffer').get(**params)
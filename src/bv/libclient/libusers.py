@@ -1,7 +1,10 @@
 from bv.libclient.baselib import BaseLib
 from bv.libclient.utils import json_unpack, ApiObject, dict_to_object
+from bv.libclient.constants import DEFAULT_WORKERS
 
 class User(ApiObject):
+    _fields = ('id', 'username', 'first_name', 'last_name', 'email')
+
     def is_authenticated(self):
         return True
 
@@ -23,3 +26,10 @@ class LibUsers(BaseLib):
     def get_user(self, user_id):
         resp = self.get_resource('user').get(path='%s/' % user_id)
         return resp
+
+    def get_users(self, user_ids, workers=DEFAULT_WORKERS):
+        """Return a dict mapping each user id to its user, fetched
+        concurrently. Missing users are mapped to a ResourceDoesNotExist.
+
+        """
+        return self._get_many(self.get_user, user_ids, workers)
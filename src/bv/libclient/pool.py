@@ -0,0 +1,163 @@
+"""Keep-alive connection pools shared by all the libs.
+
+Each server url gets its own connection manager, so every lib (LibTrips,
+LibUsers, LibTalks, LibRatings...) pointing to the same server reuses the
+same warm connections instead of paying a new TCP/TLS handshake per call.
+
+"""
+import threading
+
+from restkit.conn.threaded import TPool, TConnectionManager
+
+from bv.libclient.constants import DEFAULT_POOL_MAX_CONNECTIONS, \
+        DEFAULT_POOL_IDLE_TIMEOUT, DEFAULT_POOL_TIMEOUT
+
+class BvPool(TPool):
+    """A restkit pool for a given route, counting connection reuses.
+
+    A hit is a request served by an idle connection already in the pool, a
+    miss is a request that had to open a new connection.
+
+    """
+    def request(self):
+        self.clean_iddle_connections()
+        self.conn_manager.record(bool(self.connections))
+        return TPool.request(self)
+
+    def release(self, conn, duration=None):
+        """Keep the connection alive for the idle timeout of the manager.
+
+        """
+        if duration is None:
+            duration = self.conn_manager.idle_timeout
+        return TPool.release(self, conn, duration)
+
+class BvConnectionManager(TConnectionManager):
+    """Connection manager holding the pools of a server.
+
+    :param max_connections: number of idle connections kept per host.
+    :param idle_timeout: number of seconds an idle connection is kept alive.
+    :param timeout: socket timeout of the connections.
+
+    """
+    POOL_CLASS = BvPool
+
+    def __init__(self, max_connections=DEFAULT_POOL_MAX_CONNECTIONS,
+            idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT, timeout=DEFAULT_POOL_TIMEOUT):
+        TConnectionManager.__init__(self, timeout=timeout,
+                nb_connections=max_connections)
+        self.idle_timeout = idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get_settings(self):
+        """Return the settings the manager has been created with.
+
+        """
+        return {
+            'max_connections': self.nb_connections,
+            'idle_timeout': self.idle_timeout,
+            'timeout': self.timeout,
+        }
+
+    def record(self, hit):
+        """Count a connection request as a hit or a miss.
+
+        """
+        self._stats_lock.acquire()
+        try:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        finally:
+            self._stats_lock.release()
+
+    def get_stats(self):
+        """Return the hit/miss counters of the pool.
+
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def reset_stats(self):
+        self._stats_lock.acquire()
+        try:
+            self.hits = 0
+            self.misses = 0
+        finally:
+            self._stats_lock.release()
+
+    def shutdown(self):
+        """Close all the idle connections of all the pools.
+
+        """
+        self._lock.acquire()
+        try:
+            for pool in self._connections.values():
+                pool.shutdown()
+            self._connections = {}
+        finally:
+            self._lock.release()
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+def get_pool(server_url, max_connections=None, idle_timeout=None,
+        timeout=None):
+    """Return the connection manager shared by all the libs using server_url.
+
+    The pool is created on first use with the given settings (see
+    BvConnectionManager), the defaults being used for the ones not given.
+    Later calls return the existing one, and raise ValueError if they give
+    settings different from its own.
+
+    """
+    settings = {
+        'max_connections': max_connections,
+        'idle_timeout': idle_timeout,
+        'timeout': timeout,
+    }
+    settings = dict([(name, value) for name, value in settings.items()
+        if value is not None])
+    _managers_lock.acquire()
+    try:
+        manager = _managers.get(server_url)
+        if manager is None:
+            manager = _managers[server_url] = BvConnectionManager(**settings)
+            return manager
+        current = manager.get_settings()
+        conflicts = sorted([name for name, value in settings.items()
+            if current[name] != value])
+        if conflicts:
+            raise ValueError('The pool of %s already exists with other %s'
+                    % (server_url, ', '.join(conflicts)))
+        return manager
+    finally:
+        _managers_lock.release()
+
+def get_pool_stats():
+    """Return the hit/miss counters of every pool, by server url.
+
+    """
+    _managers_lock.acquire()
+    try:
+        return dict([(url, manager.get_stats())
+            for url, manager in _managers.items()])
+    finally:
+        _managers_lock.release()
+
+def close_pools():
+    """Close and forget all the shared pools.
+
+    """
+    _managers_lock.acquire()
+    try:
+        for manager in _managers.values():
+            manager.shutdown()
+        _managers.clear()
+    finally:
+        _managers_lock.release()
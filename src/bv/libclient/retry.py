@@ -0,0 +1,100 @@
+"""Retry of the idempotent requests on transient failures.
+
+Only the GET requests are retried by default, so the calls changing data
+(add_trip, create_talk, rate_user...) are never made twice::
+
+    lib = LibTrips(server_url, retry_policy=RetryPolicy(max_attempts=5))
+
+"""
+import time
+import random
+import socket
+
+from restkit.errors import RequestError, RequestTimeout, ResourceError
+
+from bv.libclient.constants import DEFAULT_RETRY_ATTEMPTS, \
+        DEFAULT_RETRY_BACKOFF, DEFAULT_RETRY_MAX_BACKOFF, \
+        DEFAULT_RETRY_DEADLINE
+
+class RetryPolicy(object):
+    """Retry a call on connection errors, timeouts and 502/503/504 answers.
+
+    :param max_attempts: maximum number of attempts, the first one included.
+    :param backoff: base delay in seconds, doubled after each attempt.
+    :param max_backoff: maximum delay between two attempts.
+    :param deadline: no attempt is started more than deadline seconds after
+                     the first one.
+    :param jitter: if True, wait a random delay between 0 and the computed
+                   one, so that the clients don't retry all at once.
+    :param methods: the HTTP methods that can be retried.
+    :param statuses: the HTTP statuses that can be retried.
+
+    """
+    sleep = staticmethod(time.sleep)
+
+    def __init__(self, max_attempts=DEFAULT_RETRY_ATTEMPTS,
+            backoff=DEFAULT_RETRY_BACKOFF, max_backoff=DEFAULT_RETRY_MAX_BACKOFF,
+            deadline=DEFAULT_RETRY_DEADLINE, jitter=True, methods=('GET',),
+            statuses=(502, 503, 504)):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.jitter = jitter
+        self.methods = methods
+        self.statuses = statuses
+
+    def is_retryable(self, exception):
+        """Return True if the request failed for a transient reason.
+
+        """
+        if isinstance(exception, ResourceError):
+            return exception.status_int in self.statuses
+        return isinstance(exception, (RequestError, RequestTimeout,
+            socket.error))
+
+    def get_delay(self, attempt):
+        """Return the delay to wait after the attempt-th failed attempt.
+
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def call(self, method, func):
+        """Call func (taking no arguments), retrying it if the HTTP method
+        can be retried.
+
+        """
+        if method not in self.methods:
+            return func()
+        deadline = time.time() + self.deadline
+        attempt = 1
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                if attempt >= self.max_attempts or not self.is_retryable(e):
+                    raise
+                delay = self.get_delay(attempt)
+                if time.time() + delay > deadline:
+                    raise
+            self.sleep(delay)
+            attempt += 1
+
+_default_policy = RetryPolicy()
+
+def get_default_retry_policy():
+    """Return the policy used by the libs not given a specific one.
+
+    """
+    return _default_policy
+
+def set_default_retry_policy(policy):
+    """Change the policy used by the libs not given a specific one; None
+    disables the retries.
+
+    """
+    global _default_policy
+    _default_policy = policy
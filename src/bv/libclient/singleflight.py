@@ -0,0 +1,89 @@
+"""Coalescing of concurrent identical calls.
+
+While a call is in flight, the other callers asking for the same key don't
+make it again: they wait for it and get its result (or its exception). They
+wait at most `timeout` seconds, so a call stuck on a hung connection doesn't
+block them forever::
+
+    lib = LibTrips(server_url, single_flight=get_single_flight())
+
+"""
+import sys
+import threading
+
+from bv.libclient.exceptions import SingleFlightTimeout
+from bv.libclient.constants import SINGLE_FLIGHT_TIMEOUT
+
+class _Call(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+class SingleFlight(object):
+    """Run at most one call per key at a time, sharing its outcome with the
+    callers arriving while it runs.
+
+    :param timeout: seconds the callers wait for the call in flight before
+                    raising SingleFlightTimeout.
+
+    """
+    def __init__(self, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, func):
+        """Return the result of func (taking no arguments), or of the call
+        already in flight for key.
+
+        """
+        self._lock.acquire()
+        try:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        finally:
+            self._lock.release()
+        if not leader:
+            call.event.wait(self.timeout)
+            if not call.event.isSet():
+                raise SingleFlightTimeout('The identical call in flight did '
+                        'not finish in %s seconds' % self.timeout)
+            if call.exc_info is not None:
+                raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+            return call.result
+        try:
+            call.result = func()
+        except:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            self._lock.acquire()
+            try:
+                del self._calls[key]
+            finally:
+                self._lock.release()
+            call.event.set()
+        return call.result
+
+    def get_stats(self):
+        return {
+            'leaders': self.leaders,
+            'followers': self.followers,
+            'in_flight': len(self._calls),
+        }
+
+_single_flight = SingleFlight()
+
+def get_single_flight():
+    """Return the instance shared by the whole process.
+
+    """
+    return _single_flight
@@ -5,13 +5,45 @@
 ### XXX TEST TO CHANGE : HttpResponse body !
 import unittest
 import json
-from mock import Mock
+import time
+import datetime
+import shutil
+import tempfile
+import pickle
+import copy
+import sys
+import types
+from mock import Mock, patch
 
 from bv.libclient.baselib import BvResource, BaseLib
-from bv.libclient import LibTrips, LibRatings, LibTalks, \
-    Trip, Rating, Talk, \
+from bv.libclient.pool import get_pool, close_pools
+from bv.libclient.client import BvClient
+from bv.libclient.libthreaded import ThreadedLibTrips
+from bv.libclient.workers import WorkerPool, Future, wait_all
+from bv.libclient.utils import memoize, ApiObject, set_compact_models, \
+    dict_to_object_func, json_unpack, api_to_date, api_to_time, \
+    api_to_datetime, convert_column, IdentityMap, dict_to_object_list_func
+from bv.libclient.libusers import User
+from bv.libclient.cities import CityIndex
+from bv.libclient.retry import RetryPolicy, get_default_retry_policy
+from bv.libclient.circuitbreaker import CircuitBreaker, CircuitBreakers
+from bv.libclient.singleflight import SingleFlight
+import threading
+from bv.libclient.instrumentation import add_hook, remove_hook, \
+    RequestStats, InstrumentedResponse
+from bv.libclient.jsonstream import iter_json_array, iter_json_object
+from bv.libclient.jsoncodec import get_available_backends, get_backend, \
+    set_backend, register_backend, loads as json_loads, _loaders as json_loaders
+from StringIO import StringIO
+from bv.libclient.httpcache import HttpCache, MemoryStorage, FileStorage, \
+    CacheEntry, CachedResponse, ReadCache
+from restkit import Resource
+from restkit.forms import form_encode
+from restkit.errors import ResourceNotFound, RequestFailed, RequestError
+from bv.libclient import LibTrips, LibRatings, LibTalks, LibUsers, \
+    Trip, Offer, Rating, Talk, Message, \
     ResourceDoesNotExist, ApiException, ResourceAccessForbidden, \
-    EditTripFormError 
+    EditTripFormError, CircuitOpen, SingleFlightTimeout
 
 class HttpResponse:
     """HttpResponse mock
@@ -69,6 +101,30 @@ class BaseTestCase(unittest.TestCase):
             self.lib.get_resource.return_value = res
         return res
 
+def trip_response(trip_id=7):
+    return CachedResponse(200, {}, '{"id": %d}' % trip_id)
+
+class RequestTestCase(unittest.TestCase):
+    """Build a LibTrips whose requests are answered by a mock of restkit's
+    Resource.request, returning a trip by default.
+
+    """
+    def get_lib_params(self):
+        """Return the extra arguments of the lib.
+
+        """
+        return {}
+
+    def setUp(self):
+        self.lib = LibTrips(server_url='http://api.example.com',
+                **self.get_lib_params())
+        self.request = Mock(return_value=trip_response())
+        self.patcher = patch.object(Resource, 'request', self.request)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
 class BaseLibTests(BaseTestCase):
     def test_get_pagination_params(self):
         params = (
@@ -82,6 +138,1169 @@ class BaseLibTests(BaseTestCase):
                 'count': assumed_count
             }
 
+class ResourceCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.lib = LibTrips(server_url='http://api.example.com')
+
+    def test_resource_reused(self):
+        res = self.lib.get_resource('trip')
+        assert self.lib.get_resource('trip') is res
+        assert self.lib.get_resource('city') is not res
+
+    def test_resource_by_filters(self):
+        lib = LibTrips(server_url='http://api.example.com',
+                consumer_key='key', consumer_secret='secret',
+                token_key='token', token_secret='token secret')
+        res = lib.get_resource('ogcserver', filters=[])
+        for i in range(10):
+            assert lib.get_resource('ogcserver', filters=[]) is res
+        assert lib.get_resource('ogcserver', filters=None) is not res
+        assert len(lib._resources) == 2
+        assert self.lib.get_resource('ogcserver', filters=[]) is \
+                self.lib.get_resource('ogcserver')
+
+    def test_set_filters_invalidates(self):
+        res = self.lib.get_resource('trip')
+        filters = [Mock()]
+        self.lib.set_filters(filters)
+        new_res = self.lib.get_resource('trip')
+        assert new_res is not res
+        assert new_res.filters is filters
+
+class ClientTests(unittest.TestCase):
+    def setUp(self):
+        self.client = BvClient('http://api.example.com', 'key', 'secret',
+                'token', 'token_secret')
+
+    def test_libs_share_state(self):
+        filters = self.client.get_filters()
+        assert len(filters) == 1
+        for lib in (self.client.trips, self.client.users, self.client.talks,
+                self.client.ratings):
+            assert lib.get_filters() is filters
+            assert lib.pool is self.client.pool
+            assert lib._resources is self.client._resources
+
+    def test_set_filters(self):
+        res = self.client.trips.get_resource('trip')
+        filters = [Mock()]
+        self.client.set_filters(filters)
+        assert self.client.users.get_filters() is filters
+        assert self.client.trips.get_resource('trip') is not res
+
+    def test_anonymous_client(self):
+        client = BvClient('http://api.example.com')
+        assert client.trips.get_filters() is None
+
+    def test_pipeline_options(self):
+        cache = ReadCache()
+        client = BvClient('http://api.example.com', read_cache=cache)
+        assert client.read_cache is client.trips.read_cache is cache
+        assert client.trips.options == client.options
+        assert client.users.get_resource('user').read_cache is cache
+        assert client.trips.retry_policy is get_default_retry_policy()
+        self.assertRaises(TypeError, BvClient, read_cahce=cache)
+        self.assertRaises(AttributeError, getattr, client.trips, 'unknown')
+
+class WorkerPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.workers = WorkerPool(size=2)
+
+    def tearDown(self):
+        self.workers.shutdown()
+
+    def test_submit(self):
+        futures = self.workers.map(lambda x: x * 2, range(5))
+        assert wait_all(futures) == [0, 2, 4, 6, 8]
+
+    def test_exception(self):
+        future = self.workers.submit(int, 'not an int')
+        self.assertRaises(ValueError, future.result)
+        assert isinstance(future.exception(), ValueError)
+
+    def test_done_callback(self):
+        done = []
+        future = Future()
+        future.add_done_callback(done.append)
+        assert done == []
+        future.set_result(1)
+        assert done == [future]
+        future.add_done_callback(done.append)
+        assert done == [future, future]
+
+class ThreadedLibTests(unittest.TestCase):
+    def setUp(self):
+        self.workers = WorkerPool(size=2)
+        self.lib = ThreadedLibTrips(workers=self.workers)
+
+    def tearDown(self):
+        self.workers.shutdown()
+
+    def test_get_trip(self):
+        res = Mock(BvResource)()
+        res.get.return_value = json.dumps({'title': 'value'})
+        self.lib.lib.get_resource = Mock()
+        self.lib.lib.get_resource.return_value = res
+        future = self.lib.get_trip(7)
+        assert future.result(1).title == 'value'
+        res.get.assert_called_with(path='7/')
+
+    def test_sync_methods(self):
+        assert self.lib.get_params() == self.lib.lib.get_params()
+        assert self.lib._get_pagination_params(1, 20) == \
+                {'start': 0, 'count': 20}
+
+class PoolTests(unittest.TestCase):
+    def setUp(self):
+        close_pools()
+
+    def tearDown(self):
+        close_pools()
+
+    def test_pool_shared_by_server_url(self):
+        trips = LibTrips(server_url='http://api.example.com')
+        talks = LibTalks(server_url='http://api.example.com')
+        other = LibTrips(server_url='http://other.example.com')
+        assert trips.pool is talks.pool
+        assert trips.pool is not other.pool
+
+    def test_resource_uses_pool(self):
+        lib = LibTrips(server_url='http://api.example.com')
+        res = lib.get_resource('trip')
+        assert res.client_opts['pool_instance'] is lib.pool
+
+    def test_pool_stats(self):
+        pool = get_pool('http://api.example.com')
+        pool.record(False)
+        pool.record(True)
+        pool.record(True)
+        assert pool.get_stats() == {'hits': 2, 'misses': 1}
+        pool.reset_stats()
+        assert pool.get_stats() == {'hits': 0, 'misses': 0}
+
+    def test_pool_settings(self):
+        client = BvClient('http://api.example.com',
+                pool_options={'max_connections': 4, 'timeout': 30})
+        assert client.trips.pool.get_settings() == {'max_connections': 4,
+                'idle_timeout': 300, 'timeout': 30}
+        lib = LibTrips(server_url='http://api.example.com')
+        assert lib.pool is client.pool
+        assert get_pool('http://api.example.com', max_connections=4) \
+                is client.pool
+        self.assertRaises(ValueError, get_pool, 'http://api.example.com',
+                max_connections=5)
+        self.assertRaises(ValueError, LibTrips,
+                server_url='http://api.example.com',
+                pool_options={'timeout': 10})
+
+class PagesTestCase(unittest.TestCase):
+    """Serve 45 items through a fake paginated list method.
+
+    """
+    def setUp(self):
+        self.lib = LibTrips()
+        self.items = range(45)
+        self.calls = []
+
+    def list_method(self, page=1, count=20, **kwargs):
+        self.calls.append(page)
+        start = self.lib._get_pagination_params(page, count)['start']
+        return self.items[start:start + count]
+
+class IterPagesTests(PagesTestCase):
+    def test_iter_pages(self):
+        for prefetch in (0, 1, 3):
+            self.calls = []
+            items = list(self.lib._iter_pages(self.list_method, 20, prefetch))
+            assert items == self.items
+            assert sorted(self.calls)[:3] == [1, 2, 3]
+
+    def test_iter_pages_is_lazy(self):
+        iterator = self.lib._iter_pages(self.list_method, 10, 0)
+        assert iterator.next() == 0
+        assert self.calls == [1]
+
+    def test_iter_trips(self):
+        self.lib.list_trips = Mock()
+        self.lib.list_trips.side_effect = self.list_method
+        assert list(self.lib.iter_trips(count=20, prefetch=1)) == self.items
+
+class FetchAllTests(PagesTestCase):
+    def test_fetch_all(self):
+        items = self.lib._fetch_all(self.list_method, lambda: 45, 10, 3)
+        assert items == self.items
+        assert sorted(self.calls) == [1, 2, 3, 4, 5]
+
+    def test_fetch_nothing(self):
+        assert self.lib._fetch_all(self.list_method, lambda: '0') == []
+        assert self.calls == []
+
+    def test_retry_failed_pages(self):
+        failures = [2, 2, 4]
+        def list_method(page=1, count=20, **kwargs):
+            if page in failures:
+                failures.remove(page)
+                raise ValueError(page)
+            return self.list_method(page, count)
+        items = self.lib._fetch_all(list_method, lambda: 45, 10, 2, 2)
+        assert items == self.items
+
+        failures.extend([1, 1])
+        self.assertRaises(ValueError, self.lib._fetch_all, list_method,
+                lambda: 45, 10, 2, 1)
+
+    def test_fetch_all_trips(self):
+        self.lib.list_trips = Mock()
+        self.lib.list_trips.side_effect = self.list_method
+        self.lib.count_trips = Mock()
+        self.lib.count_trips.return_value = 45
+        assert self.lib.fetch_all_trips(workers=4) == self.items
+
+class GetManyTests(unittest.TestCase):
+    def setUp(self):
+        self.lib = LibUsers()
+        self.calls = []
+
+    def get_user(self, user_id):
+        self.calls.append(user_id)
+        if user_id == 404:
+            raise ResourceNotFound('not found')
+        return {'id': user_id}
+
+    def test_get_many(self):
+        users = self.lib._get_many(self.get_user, [1, 2, 1, 404, 2], 2)
+        assert sorted(self.calls) == [1, 2, 404]
+        assert users[1] == {'id': 1}
+        assert users[2] == {'id': 2}
+        assert isinstance(users[404], ResourceDoesNotExist)
+        assert self.lib._get_many(self.get_user, []) == {}
+
+    def test_get_many_errors(self):
+        def get_user(user_id):
+            raise ValueError(user_id)
+        self.assertRaises(ValueError, self.lib._get_many, get_user, [1])
+
+    def test_get_users(self):
+        self.lib.get_user = Mock()
+        self.lib.get_user.side_effect = self.get_user
+        assert self.lib.get_users(iter([3, 3]), workers=1) == {3: {'id': 3}}
+        self.lib.get_user.assert_called_once_with(3)
+
+class HttpCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = HttpCache()
+        self.resource = BvResource('http://api.example.com/trips/')
+        self.resource.http_cache = self.cache
+
+    def _request(self, *responses, **kwargs):
+        request = Mock()
+        request.side_effect = list(responses)
+        patcher = patch.object(Resource, 'request', request)
+        patcher.start()
+        try:
+            return self.resource.get(**kwargs), request
+        finally:
+            patcher.stop()
+
+    def test_revalidation(self):
+        ok = CachedResponse(200, {'etag': '"v1"'}, '{"id": 7}')
+        resp, request = self._request(ok, path='7/')
+        assert resp.body_string() == '{"id": 7}'
+        assert self.cache.get_stats() == {'hits': 0, 'misses': 1}
+
+        not_modified = CachedResponse(304, {}, '')
+        not_modified.close = Mock()
+        resp, request = self._request(not_modified, path='7/')
+        assert resp.body_string() == '{"id": 7}'
+        assert not_modified.close.called
+        assert ('If-None-Match', '"v1"') in request.call_args[0][3]
+        assert self.cache.get_stats() == {'hits': 1, 'misses': 1}
+
+    def test_no_validators(self):
+        ok = CachedResponse(200, {}, '[]')
+        resp, request = self._request(ok)
+        assert resp is ok
+        resp, request = self._request(ok)
+        assert request.call_args[0][3] is None
+        assert self.cache.get_stats() == {'hits': 0, 'misses': 2}
+
+    def test_miss_not_stored(self):
+        error = CachedResponse(503, {}, '')
+        resp, request = self._request(error, path='7/')
+        assert resp is error
+        assert self.cache.get_stats() == {'hits': 0, 'misses': 1}
+        assert self.cache.storage.get(self.resource.get_cache_key('7/')) \
+                is None
+
+    def test_memory_storage_limits(self):
+        storage = MemoryStorage(max_entries=2, max_size=10)
+        storage.set('a', CacheEntry({}, '1234'))
+        storage.set('b', CacheEntry({}, '1234'))
+        storage.get('a')
+        storage.set('c', CacheEntry({}, '1234'))
+        assert storage.get('b') is None
+        assert storage.get('a').body == '1234'
+        storage.set('d', CacheEntry({}, '12345678'))
+        assert storage.get('a') is None and storage.get('c') is None
+        storage.set('e', CacheEntry({}, '12345678901'))
+        assert storage.get('e') is None
+        assert storage.size == 8
+
+    def test_file_storage(self):
+        directory = tempfile.mkdtemp()
+        try:
+            storage = FileStorage(directory, max_entries=1)
+            storage.set('a', CacheEntry({'etag': 'x'}, 'body'))
+            assert storage.get('a').etag == 'x'
+            storage.set('b', CacheEntry({}, 'body'))
+            assert storage.get('a') is None
+            assert storage.get('b').body == 'body'
+            storage.clear()
+            assert storage.get('b') is None
+        finally:
+            shutil.rmtree(directory)
+
+    def test_lib_resources_use_cache(self):
+        lib = LibTrips(server_url='http://api.example.com',
+                http_cache=self.cache)
+        assert lib.get_resource('trip').http_cache is self.cache
+
+class ReadCacheTests(RequestTestCase):
+    def get_lib_params(self):
+        self.cache = ReadCache()
+        return {'read_cache': self.cache}
+
+    def test_identical_gets(self):
+        assert self.lib.get_trip(7).id == 7
+        assert self.lib.get_trip(7).id == 7
+        assert self.request.call_count == 1
+        self.lib.get_trip(8)
+        assert self.request.call_count == 2
+        assert self.cache.get_stats() == {'hits': 1, 'misses': 2}
+
+    def test_shared_by_libs(self):
+        other = LibTrips(**self.lib.get_params())
+        self.lib.get_trip(7)
+        other.get_trip(7)
+        assert self.request.call_count == 1
+
+    def test_errors_not_cached(self):
+        self.request.return_value = CachedResponse(500, {}, '')
+        res = self.lib.get_resource('trip')
+        res.get(path='7/')
+        res.get(path='7/')
+        assert self.request.call_count == 2
+
+    def test_cleared_by_writes(self):
+        res = self.lib.get_resource('trip')
+        res.get(path='7/')
+        res.delete(path='7/')
+        res.get(path='7/')
+        assert self.request.call_count == 3
+        self.cache.clear()
+        res.get(path='7/')
+        assert self.request.call_count == 4
+
+class InstrumentationTests(RequestTestCase):
+    def setUp(self):
+        RequestTestCase.setUp(self)
+        self.events = []
+        self.stats = RequestStats(buckets=(100, 1000))
+        add_hook(self.events.append)
+        add_hook(self.stats)
+
+    def tearDown(self):
+        RequestTestCase.tearDown(self)
+        remove_hook(self.events.append)
+        remove_hook(self.stats)
+
+    def test_request_event(self):
+        assert self.lib.get_trip(7).id == 7
+        event, = self.events
+        assert (event.endpoint, event.method, event.path, event.status) == \
+                ('trip', 'GET', '7/', 200)
+        assert event.bytes_in == 9 and event.exception is None
+        assert event.bytes_out == 0
+        assert 0 <= event.time_to_headers <= event.total_time
+        assert event.body_time >= 0
+        assert abs(event.total_time - event.time_to_headers -
+                event.body_time) < 1e-6
+
+    def test_body_never_read(self):
+        self.request.return_value = CachedResponse(200, {}, '')
+        lib = LibTalks(server_url='http://api.example.com')
+        lib.validate_talk(3)
+        event, = self.events
+        assert (event.endpoint, event.method, event.status) == \
+                ('talks', 'PUT', 200)
+        assert event.total_time is not None and event.body_time is None
+        assert event.bytes_out == len(form_encode({'validate': 'true'}))
+        stats = self.stats.get_stats()['talks']
+        assert stats['count'] == 1 and stats['completed'] == 0
+        assert stats['bytes_out'] == event.bytes_out
+        assert stats['headers_histogram'] == [1, 0, 0]
+        assert stats['histogram'] == [0, 0, 0]
+        assert stats['mean_time'] is None
+
+    def test_failed_request(self):
+        self.request.side_effect = ResourceNotFound('not found')
+        self.assertRaises(ResourceNotFound, self.lib.get_trip, 7)
+        event, = self.events
+        assert event.status == 404 and event.total_time is not None
+        assert isinstance(event.exception, ResourceNotFound)
+
+    def test_stream_event(self):
+        self.request.return_value = CachedResponse(200, {}, '[{"id": 1}]')
+        assert [trip.id for trip in self.lib.list_trips(stream=True)] == [1]
+        event, = self.events
+        assert event.bytes_in == 11
+
+    def test_stats(self):
+        self.lib.get_trip(7)
+        self.lib.get_trip(8)
+        stats = self.stats.get_stats()['trip']
+        assert stats['count'] == 2 and stats['errors'] == 0
+        assert stats['completed'] == 2
+        assert stats['bytes_in'] == 18
+        assert stats['histogram'] == [2, 0, 0]
+        assert stats['headers_histogram'] == [2, 0, 0]
+        assert self.stats.get_percentile('trip', 99) == 100
+        self.stats.reset()
+        assert self.stats.get_stats() == {}
+
+    def test_no_hooks(self):
+        remove_hook(self.events.append)
+        remove_hook(self.stats)
+        response = CachedResponse(200, {}, '{}')
+        self.request.return_value = response
+        assert self.lib.get_resource('trip').get() is response
+
+    def test_failing_hook(self):
+        def hook(event):
+            raise ValueError()
+        add_hook(hook)
+        try:
+            assert self.lib.get_trip(7).id == 7
+        finally:
+            remove_hook(hook)
+
+class RetryTests(RequestTestCase):
+    def get_lib_params(self):
+        self.policy = RetryPolicy(max_attempts=3, backoff=0.1, max_backoff=0.15)
+        self.sleeps = []
+        self.policy.sleep = self.sleeps.append
+        return {'retry_policy': self.policy}
+
+    def test_transient_failures(self):
+        self.request.side_effect = [RequestError('reset'),
+            RequestFailed('unavailable', 503),
+            trip_response()]
+        assert self.lib.get_trip(7).id == 7
+        assert self.request.call_count == 3
+        assert len(self.sleeps) == 2
+        assert 0 <= self.sleeps[0] <= 0.1 and 0 <= self.sleeps[1] <= 0.15
+
+    def test_max_attempts(self):
+        self.request.side_effect = RequestFailed('bad gateway', 502)
+        self.assertRaises(RequestFailed, self.lib.get_trip, 7)
+        assert self.request.call_count == 3
+
+    def test_not_retryable(self):
+        self.request.side_effect = RequestFailed('error', 500)
+        self.assertRaises(RequestFailed, self.lib.get_trip, 7)
+        self.request.side_effect = ResourceNotFound('not found')
+        self.assertRaises(ResourceNotFound, self.lib.get_trip, 7)
+        assert self.request.call_count == 2
+
+    def test_mutations_not_retried(self):
+        self.request.side_effect = RequestError('reset')
+        self.assertRaises(RequestError, self.lib.delete_trip, 7)
+        self.assertRaises(RequestError, self.lib.add_trip, name='trip')
+        assert self.request.call_count == 2
+
+    def test_deadline(self):
+        self.policy.deadline = 0
+        self.policy.jitter = False
+        self.request.side_effect = RequestError('reset')
+        self.assertRaises(RequestError, self.lib.get_trip, 7)
+        assert self.request.call_count == 1
+
+    def test_disabled(self):
+        self.request.side_effect = RequestError('reset')
+        lib = LibTrips(server_url='http://api.example.com', retry_policy=None)
+        assert lib.retry_policy is None
+        self.assertRaises(RequestError, lib.get_trip, 7)
+        assert self.request.call_count == 1
+        client = BvClient('http://api.example.com', retry_policy=None)
+        assert client.trips.retry_policy is None
+        self.assertRaises(RequestError, client.trips.get_trip, 7)
+        assert self.request.call_count == 2
+        assert client.trips.get_resource('trip').retry_policy is None
+        assert self.sleeps == []
+
+class CircuitBreakerTests(RequestTestCase):
+    def get_lib_params(self):
+        self.breakers = CircuitBreakers(window=10, min_calls=4,
+                failure_rate=0.5, slow_call=1, slow_rate=0.75, open_timeout=5)
+        return {'circuit_breakers': self.breakers,
+                'retry_policy': RetryPolicy(max_attempts=1)}
+
+    def setUp(self):
+        RequestTestCase.setUp(self)
+        self.now = 1000.0
+        self.breaker = self.lib.get_resource('trip').circuit_breaker
+        self.breaker.clock = lambda: self.now
+
+    def fail_calls(self, count, exception=None):
+        self.request.side_effect = exception or RequestFailed('error', 503)
+        for i in range(count):
+            self.assertRaises(Exception, self.lib.get_trip, 7)
+        self.request.side_effect = None
+
+    def test_per_endpoint(self):
+        assert self.breaker is self.breakers.get('trip')
+        assert self.lib.get_resource('city').circuit_breaker is not self.breaker
+        assert isinstance(self.breaker, CircuitBreaker)
+
+    def test_opens_and_recovers(self):
+        self.lib.get_trip(7)
+        self.lib.get_trip(7)
+        self.fail_calls(1)
+        assert self.breaker.state == 'closed'
+        self.fail_calls(1)
+        assert self.breaker.state == 'open'
+        calls = self.request.call_count
+        self.assertRaises(CircuitOpen, self.lib.get_trip, 7)
+        assert self.request.call_count == calls
+        assert self.breakers.get_states()['trip']['rejected'] == 1
+
+        self.now += 5
+        self.fail_calls(1)
+        assert self.breaker.state == 'open'
+        self.now += 5
+        assert self.lib.get_trip(7).id == 7
+        assert self.breaker.get_state()['state'] == 'closed'
+
+    def test_client_errors_and_window(self):
+        self.fail_calls(4, ResourceNotFound('not found'))
+        assert self.breaker.state == 'closed'
+        self.fail_calls(3)
+        self.now += 11
+        self.fail_calls(1)
+        assert self.breaker.state == 'closed'
+        assert self.breaker.get_state()['failures'] == 1
+
+    def test_slow_calls(self):
+        def slow_request(*args, **kwargs):
+            self.now += 2
+            return trip_response()
+        self.request.side_effect = slow_request
+        for i in range(4):
+            self.lib.get_trip(7)
+        assert self.breaker.state == 'open'
+
+    def test_half_open_probes(self):
+        self.fail_calls(4)
+        self.now += 5
+        assert self.breaker.before_call() is True
+        self.assertRaises(CircuitOpen, self.breaker.before_call)
+        self.breaker.record(False, 0, probe=True)
+        assert self.breaker.state == 'closed'
+
+class SingleFlightTests(RequestTestCase):
+    def get_lib_params(self):
+        self.single_flight = SingleFlight()
+        self.release = threading.Event()
+        return {'single_flight': self.single_flight}
+
+    def run_concurrently(self, func, count):
+        results = []
+        def target():
+            try:
+                results.append(func())
+            except Exception as e:
+                results.append(e)
+        threads = [threading.Thread(target=target) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        deadline = time.time() + 5
+        while self.single_flight.followers < count - 1 \
+                and time.time() < deadline:
+            time.sleep(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_coalesced(self):
+        def request(*args, **kwargs):
+            self.release.wait(5)
+            return trip_response()
+        self.request.side_effect = request
+        trips = self.run_concurrently(lambda: self.lib.get_trip(7), 4)
+        assert [trip.id for trip in trips] == [7] * 4
+        assert len(set(map(id, trips))) == 4
+        assert self.request.call_count == 1
+        assert self.single_flight.get_stats() == {'leaders': 1,
+                'followers': 3, 'in_flight': 0}
+
+    def test_shared_exception(self):
+        def request(*args, **kwargs):
+            self.release.wait(5)
+            raise ResourceNotFound('not found')
+        self.request.side_effect = request
+        errors = self.run_concurrently(lambda: self.lib.get_trip(7), 3)
+        assert [type(e) for e in errors] == [ResourceNotFound] * 3
+        assert self.request.call_count == 1
+
+    def test_timeout(self):
+        self.single_flight.timeout = 0.01
+        def request(*args, **kwargs):
+            self.release.wait(5)
+            return trip_response()
+        self.request.side_effect = request
+        leader = threading.Thread(target=self.lib.get_trip, args=(7,))
+        leader.start()
+        try:
+            while not self.single_flight.get_stats()['in_flight']:
+                time.sleep(0.001)
+            self.assertRaises(SingleFlightTimeout, self.lib.get_trip, 7)
+        finally:
+            self.release.set()
+            leader.join(5)
+
+    def test_different_queries(self):
+        self.lib.get_trip(7)
+        self.lib.get_trip(8)
+        self.lib.get_trip(7)
+        assert self.request.call_count == 3
+
+class StubLazyObject(object):
+    """What ext.dj uses of django's SimpleLazyObject."""
+    def __init__(self, func):
+        self.__dict__['_func'] = func
+
+    def __getattr__(self, name):
+        if '_wrapped' not in self.__dict__:
+            self.__dict__['_wrapped'] = self._func()
+        return getattr(self._wrapped, name)
+
+class DjangoExtTests(RequestTestCase):
+    """Test bv.libclient.ext.dj with stubs of django and oauthclient."""
+    def setUp(self):
+        RequestTestCase.setUp(self)
+        settings = Mock(spec=[])
+        settings.BVCLIENT_BVUSER_CACHE_TTL = 60
+        token = Mock(key='key', secret='secret')
+        token.server.server_url = 'http://api.example.com'
+        modules = {}
+        for name in ('django', 'django.conf', 'django.utils',
+                'django.utils.functional', 'oauthclient',
+                'oauthclient.utils'):
+            modules[name] = types.ModuleType(name)
+        modules['django.conf'].settings = settings
+        modules['django.utils.functional'].SimpleLazyObject = StubLazyObject
+        utils = modules['oauthclient.utils']
+        utils.get_consumer_token = Mock(return_value=token)
+        utils.is_oauth_authenticated = lambda request, identifier: \
+                identifier + '_oauth_token' in request.session
+        utils.need_oauth_authentication = Mock()
+        self.modules = patch.dict(sys.modules, modules)
+        self.modules.start()
+        sys.modules.pop('bv.libclient.ext.dj', None)
+        from bv.libclient.ext import dj
+        self.dj = dj
+        self.request.return_value = CachedResponse(200, {},
+            '{"id": 3, "username": "bob"}')
+        self.session = {'bisonvert_oauth_token': 'token',
+                'bisonvert_oauth_token_secret': 'token secret'}
+
+    def tearDown(self):
+        RequestTestCase.tearDown(self)
+        self.modules.stop()
+        sys.modules.pop('bv.libclient.ext.dj', None)
+
+    def new_request(self):
+        request = Mock(spec=[])
+        request.session = self.session
+        self.dj.AuthenticationMiddleware().process_request(request)
+        return request
+
+    def test_lazy_fetch(self):
+        request = self.new_request()
+        context = self.dj.bvauth(request)
+        assert self.request.call_count == 0
+        assert context['bvuser'].username == 'bob'
+        assert request.bvuser.id == 3
+        assert self.request.call_count == 1
+        assert not hasattr(Mock, 'bvuser')
+
+    def test_session_cache(self):
+        self.new_request().bvuser.username
+        json.dumps(self.session['_bvuser'])
+        user = self.dj.get_bvuser(self.new_request())
+        assert (user.__class__, user.id, user.username) == (User, 3, 'bob')
+        assert self.request.call_count == 1
+        self.session['bisonvert_oauth_token'] = 'other token'
+        self.new_request().bvuser.username
+        assert self.request.call_count == 2
+
+    def test_session_expiry(self):
+        self.new_request().bvuser.username
+        expires = self.session['_bvuser'][1]
+        clock = patch('time.time', Mock(return_value=expires + 1))
+        clock.start()
+        try:
+            self.new_request().bvuser.username
+        finally:
+            clock.stop()
+        assert self.request.call_count == 2
+
+    def test_invalidate(self):
+        request = self.new_request()
+        request.bvuser.username
+        self.dj.invalidate_bvuser(request)
+        assert '_bvuser' not in self.session
+        self.new_request().bvuser.username
+        assert self.request.call_count == 2
+
+    def test_not_authenticated(self):
+        self.session.clear()
+        request = self.new_request()
+        assert request.bvuser is None
+        assert self.dj.bvauth(request)['bvuser'] is None
+        assert self.dj.get_bvuser(request) is None
+        assert self.request.call_count == 0
+
+    def test_authenticated_is_lazy(self):
+        request = self.new_request()
+        assert isinstance(request.bvuser, StubLazyObject)
+        assert self.request.call_count == 0
+
+class MemoizeTests(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.time = patch('time.time')
+        self.time.start().return_value = 100
+
+    def tearDown(self):
+        self.time.stop()
+
+    def method(self, lib, value):
+        self.calls.append(value)
+        return value
+
+    def test_ttl(self):
+        cached = memoize(10, 5)(self.method)
+        cached(self, 1)
+        cached(self, 1)
+        assert self.calls == [1]
+        time.time.return_value = 111
+        cached(self, 1)
+        assert self.calls == [1, 1]
+
+    def test_lru(self):
+        cached = memoize(10, 2)(self.method)
+        for value in (1, 2, 1, 3, 1, 2):
+            cached(self, value)
+        assert self.calls == [1, 2, 3, 2]
+        assert cached.cache_info()['size'] == 2
+
+    def test_stream_not_cached(self):
+        lib = LibTrips()
+        lib.get_cartypes.cache_clear()
+        request = Mock(return_value=CachedResponse(200, {},
+            '[{"id": 1, "name": "a"}]'))
+        patcher = patch.object(Resource, 'request', request)
+        patcher.start()
+        try:
+            for i in range(2):
+                cartypes = lib.get_cartypes(stream=True)
+                assert [cartype.name for cartype in cartypes] == [u'a']
+            assert request.call_count == 2
+            assert lib.get_cartypes.cache_info()['size'] == 0
+        finally:
+            patcher.stop()
+            lib.get_cartypes.cache_clear()
+
+class CityIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.index = CityIndex(limit=3)
+
+    def test_complete_results(self):
+        assert self.index.lookup('par') is None
+        self.index.add('Par', [{'name': 'Paris'}, {'name': 'Parthenay'}])
+        assert self.index.lookup('pari') == [{'name': 'Paris'}]
+        assert self.index.lookup('Parthenay') == [{'name': 'Parthenay'}]
+        assert self.index.lookup('parx') == []
+        assert self.index.lookup('pa') is None
+
+    def test_incomplete_results(self):
+        self.index.add('p', ['Paris', 'Pau', 'Pons'])
+        assert self.index.lookup('pa') is None
+
+    def test_load(self):
+        self.index.load(['Saint-Malo', 'Saint-Brieuc', 'Saint-Lo', 'Rennes',
+            'Saint-Denis'])
+        assert self.index.lookup('saint m') == ['Saint-Malo']
+        assert self.index.lookup('saint-') == ['Saint-Malo', 'Saint-Brieuc',
+            'Saint-Lo']
+        assert self.index.lookup('') == ['Saint-Malo', 'Saint-Brieuc',
+            'Saint-Lo']
+        self.assertRaises(ValueError, self.index.load, [{'id': 1}])
+
+    def test_server_order(self):
+        self.index.add('p', ['Pau', 'Paris'])
+        assert self.index.lookup('pa') == ['Pau', 'Paris']
+
+    def test_unreadable_names(self):
+        self.index.add('p', [{'name': 'Paris'}, {'label': 'Pau'}])
+        assert self.index.lookup('pa') is None
+        self.index.add('p', ['Paris', 'Lyon'])
+        assert self.index.lookup('pa') is None
+
+    def test_bounds(self):
+        clock = patch('time.time', Mock(return_value=100))
+        clock.start()
+        try:
+            index = CityIndex(limit=3, ttl=10, max_entries=2)
+            index.add('a', ['Agen'])
+            index.add('b', ['Brest'])
+            index.lookup('a')
+            index.add('c', ['Caen'])
+            assert index.lookup('b') is None
+            assert index.lookup('a') == ['Agen']
+            time.time.return_value = 110
+            assert index.lookup('a') is None
+        finally:
+            clock.stop()
+
+    def test_get_cities(self):
+        lib = LibTrips()
+        lib.city_index = self.index
+        lib._get_cities = Mock()
+        lib._get_cities.return_value = [{'name': 'Nantes'}]
+        assert lib.get_cities('Nan') == [{'name': 'Nantes'}]
+        assert lib.get_cities('Nant') == [{'name': 'Nantes'}]
+        lib._get_cities.assert_called_once_with('Nan')
+
+class ApiObjectTests(unittest.TestCase):
+    def test_hydration_plan(self):
+        class Child(ApiObject):
+            pass
+        class Parent(ApiObject):
+            _class_keys = {'child': Child, 'user': User}
+            clean_value = staticmethod(int)
+            def clean_name(self, value):
+                return value.upper()
+            clean_user = staticmethod(lambda value: value or None)
+        obj = Parent(value='1', name='a', child={'a': 1}, user={}, other=2)
+        assert (obj.value, obj.name, obj.other) == (1, 'A', 2)
+        assert obj.child.a == 1
+        assert obj.user is None
+        plan = Parent._get_hydration_plan()
+        assert Parent._get_hydration_plan() is plan
+        assert sorted(plan.keys()) == ['child', 'name', 'user', 'value']
+        assert Child._get_hydration_plan() == {}
+
+    def test_trip_hydration(self):
+        trip = Trip(date='2010-12-31', user={'id': 1}, offer={'steps': []},
+                demand=None)
+        assert trip.date.year == 2010
+        assert isinstance(trip.user, User)
+        assert trip.offer.checkpoints == []
+        assert trip.demand is None
+
+class SerializationTests(unittest.TestCase):
+    def setUp(self):
+        self.data = {'id': 1, 'date': '2010-12-31', 'time': '08:05:00',
+            'creation_date': '2010-11-02 10:12:00', 'offer': {'steps': ['A']},
+            'user': {'id': 2, 'username': 'joe'}, 'dows': [1, 2], 'demand': None}
+
+    def test_to_dict(self):
+        trip = Trip(**self.data)
+        trip_dict = trip.to_dict()
+        assert trip_dict['date'] == datetime.date(2010, 12, 31)
+        assert isinstance(trip_dict['offer'], Offer)
+        assert trip_dict['trip_type'] == 0 and trip_dict['print_dows'] == 'Tue-Wed'
+        assert not [key for key in trip_dict if key.startswith('_')]
+        assert 'name' not in Trip(id=2).to_dict()
+        assert Trip._get_class_fields() == ('print_dows', 'trip_type',
+                'trip_type_name')
+
+    def test_to_json(self):
+        trip = Trip(**self.data)
+        decoded = json.loads(trip.to_json())
+        assert decoded['date'] == '2010-12-31' and decoded['time'] == '08:05:00'
+        assert decoded['creation_date'] == '2010-11-02 10:12:00'
+        assert decoded['offer'] == {'steps': ['A'], 'checkpoints': ['A']}
+        assert decoded['user'] == {'id': 2, 'username': 'joe'}
+        assert decoded['trip_type_name'] == 'Offer'
+        assert Trip(**decoded).date == trip.date
+
+    def test_compact_to_json(self):
+        set_compact_models(True)
+        try:
+            trip = dict_to_object_func(self.data, Trip)
+        finally:
+            set_compact_models(False)
+        assert json.loads(trip.to_json()) == json.loads(
+                Trip(**self.data).to_json())
+
+class IdentityMapTests(unittest.TestCase):
+    def make_messages(self):
+        user = {'id': 1, 'username': 'joe'}
+        talk = {'id': 3, 'from_user': user,
+            'trip': {'id': 2, 'user': user, 'offer': {'steps': []}}}
+        return json.loads(json.dumps([{'id': i, 'from_user': True,
+            'talk': talk} for i in range(3)]))
+
+    def test_messages_share_nested_objects(self):
+        messages = dict_to_object_list_func(self.make_messages(), Message)
+        assert messages[0].talk is messages[2].talk
+        assert messages[0].user is messages[1].to_user
+        assert messages[0].user is messages[0].talk.from_user
+        assert messages[0] is not messages[1]
+
+    def test_different_data_not_shared(self):
+        ratings = dict_to_object_list_func([
+            {'id': 1, 'from_user': {'id': 1, 'username': 'joe'}},
+            {'id': 2, 'from_user': {'id': 1, 'username': 'joe'}},
+            {'id': 3, 'from_user': {'id': 1, 'username': 'bob'}},
+            {'id': 4, 'from_user': {'username': 'joe'}},
+            {'id': 5, 'from_user': {'username': 'joe'}}], Rating)
+        assert ratings[0].from_user is ratings[1].from_user
+        assert ratings[2].from_user.username == 'bob'
+        assert ratings[3].from_user is not ratings[4].from_user
+
+    def test_separate_responses(self):
+        first = dict_to_object_list_func(self.make_messages(), Message)
+        second = dict_to_object_list_func(self.make_messages(), Message)
+        assert first[0].talk is not second[0].talk
+
+    def test_lib_identity_map(self):
+        identity_map = IdentityMap()
+        lib = LibRatings(identity_map=identity_map)
+        res = Mock(BvResource)()
+        res.get.return_value = json.dumps([{'id': 1,
+            'from_user': {'id': 1, 'username': 'joe'}}])
+        lib.get_resource = Mock(return_value=res)
+        first = lib.get_received_ratings()
+        second = lib.get_given_ratings()
+        assert first[0].from_user is second[0].from_user
+        assert identity_map.hits == 1 and len(identity_map) == 1
+
+    def test_compact_and_pickle(self):
+        set_compact_models(True)
+        try:
+            messages = dict_to_object_list_func(self.make_messages(), Message)
+            trips = dict_to_object_list_func([{'id': 1, 'user': {'id': 1}},
+                {'id': 2, 'user': {'id': 1}}], Trip)
+        finally:
+            set_compact_models(False)
+        assert trips[0].user is trips[1].user
+        assert messages[0].talk.trip.user is messages[1].talk.from_user
+        copy = pickle.loads(pickle.dumps(messages[0]))
+        assert '_identity_map' not in copy.__dict__
+        assert copy.talk.from_user.username == 'joe'
+
+class LazyHydrationTests(unittest.TestCase):
+    def setUp(self):
+        self.data = {
+            'date': '2010-12-31 10:00:00',
+            'from_user': True,
+            'talk': {
+                'from_user': {'id': 2},
+                'trip': {'user': {'id': 1}, 'date': '2010-12-31'},
+            },
+        }
+
+    def test_lazy_message(self):
+        message = Message(**self.data)
+        assert 'talk' not in message.__dict__
+        assert 'date' not in message.__dict__
+        assert message.from_user is True
+        assert message.user.id == 2
+        assert isinstance(message.__dict__['talk'], Talk)
+        assert 'trip' not in message.talk.__dict__
+        assert message.to_user.id == 1
+        assert message.date.hour == 10
+        assert message._raw is None
+
+    def test_lazy_to_dict(self):
+        trip = Trip(id=1, date='2010-12-31', user={'id': 1})
+        trip_dict = trip.to_dict({})
+        assert trip_dict['date'].year == 2010
+        assert isinstance(trip_dict['user'], User)
+        self.assertRaises(AttributeError, getattr, trip, 'time')
+        assert trip.get('time', None) is None
+
+    def test_lazy_copy(self):
+        for compact in (False, True):
+            set_compact_models(compact)
+            try:
+                trip = dict_to_object_func({'date': '2010-12-31',
+                    'user': {'id': 1}}, Trip)
+                copies = [copy.copy(trip), copy.deepcopy(trip)]
+                assert trip.user.id == 1
+                for other in copies:
+                    assert other.user.id == 1
+                    assert other.date.year == 2010
+            finally:
+                set_compact_models(False)
+
+    def test_lazy_compact(self):
+        set_compact_models(True)
+        try:
+            trip = dict_to_object_func({'date': '2010-12-31',
+                'user': {'id': 1}}, Trip)
+            assert sorted(trip._raw.keys()) == ['date', 'user']
+            assert trip.user.id == 1
+            assert trip._get_fields()['date'].year == 2010
+            assert trip._raw is None
+        finally:
+            set_compact_models(False)
+
+class CompactModelsTests(unittest.TestCase):
+    def setUp(self):
+        set_compact_models(True)
+
+    def tearDown(self):
+        set_compact_models(False)
+
+    def test_compact_trip(self):
+        trip = dict_to_object_func({'id': 1, 'date': '2010-12-31',
+            'user': {'id': 2, 'nickname': 'nick'}, 'offer': {'steps': []},
+            'extra': 'value'}, Trip)
+        assert trip.__class__ is Trip.get_compact_class()
+        assert not hasattr(trip, '__dict__')
+        assert trip.id == 1 and trip.extra == 'value'
+        assert trip.date.year == 2010
+        assert trip.get('name', 'default') == 'default'
+        self.assertRaises(AttributeError, getattr, trip, 'name')
+        assert trip.user.nickname == 'nick'
+        assert not hasattr(trip.user, '__dict__')
+        assert trip.offer.checkpoints == []
+        assert trip.trip_type == 0
+
+        trip_dict = trip.to_dict({})
+        assert trip_dict['extra'] == 'value' and trip_dict['trip_type'] == 0
+        assert 'name' not in trip_dict
+
+        copy = pickle.loads(pickle.dumps(trip, pickle.HIGHEST_PROTOCOL))
+        assert (copy.id, copy.extra) == (1, 'value')
+
+    def test_not_declared(self):
+        rating = dict_to_object_func({'id': 1}, Rating)
+        assert rating.__class__ is Rating
+
+class JsonStreamTests(unittest.TestCase):
+    def test_iter_json_array(self):
+        data = [{'a': [1, 2, {'b': u'\xe9t\xe9'}]}, 12345, 'text, ]', None, []]
+        body = json.dumps(data, indent=2)
+        for chunk_size in (1, 3, 7, 1024):
+            assert list(iter_json_array(body, chunk_size)) == data
+        assert list(iter_json_array(' [ ] ')) == []
+        self.assertRaises(ValueError, list, iter_json_array('[1, 2'))
+        self.assertRaises(ValueError, list, iter_json_array('{}'))
+
+    def test_split_numbers(self):
+        body = '[{"a": 1.5}, 12.25, 1e-05, -3E+2, 0, "x"]'
+        data = json.loads(body)
+        for chunk_size in range(1, len(body) + 1):
+            assert list(iter_json_array(body, chunk_size)) == data, chunk_size
+
+    def test_stream_is_lazy(self):
+        stream = StringIO('[1, 2, ' + 'x' * 100)
+        items = iter_json_array(stream, 4)
+        assert items.next() == 1
+        assert stream.tell() < 20
+
+    def test_iter_json_object(self):
+        body = json.dumps({'trip': {'id': 1}, 'trip_offers': [1, 2],
+            'trip_demands': None})
+        for chunk_size in (2, 1024):
+            items = list(iter_json_object(body, ('trip_offers',), chunk_size))
+            assert sorted(items) == [('trip', {'id': 1}),
+                    ('trip_demands', None), ('trip_offers', 1),
+                    ('trip_offers', 2)]
+        assert list(iter_json_object('{}')) == []
+
+class JsonCodecTests(unittest.TestCase):
+    def tearDown(self):
+        set_backend()
+
+    def test_stdlib_fallback(self):
+        names = [backend.name for backend in get_available_backends()]
+        assert names[-1] == 'json'
+        assert set_backend('json').loads is json.loads
+        assert json_loads('{"a": [1, 2]}') == {'a': [1, 2]}
+        self.assertRaises(ValueError, set_backend, 'unknown')
+
+    def test_json_unpack_uses_backend(self):
+        loads = Mock(return_value={'id': 1})
+        register_backend('mocked', loads, json.dumps)
+        try:
+            set_backend()
+            assert get_backend().name == 'mocked'
+            unpacked = json_unpack()(lambda: CachedResponse(200, {}, '{}'))
+            assert unpacked() == {'id': 1}
+            loads.assert_called_with('{}')
+        finally:
+            del json_loaders[0]
+
+class DateConvertersTests(unittest.TestCase):
+    def setUp(self):
+        for converter in (api_to_date, api_to_time, api_to_datetime):
+            converter.cache_clear()
+
+    def assertSameAsStrptime(self, converter, reference, values):
+        for value in values:
+            try:
+                expected = reference(value)
+            except ValueError:
+                self.assertRaises(ValueError, converter, value)
+            else:
+                result = converter(value)
+                assert result == expected and type(result) is type(expected), \
+                        value
+                assert converter(value) == expected
+
+    def test_api_to_date(self):
+        reference = lambda value: datetime.date(
+                *time.strptime(value, '%Y-%m-%d')[:3])
+        self.assertSameAsStrptime(api_to_date, reference, ['2010-01-05',
+            u'1999-12-31', '2012-02-29', '2010-1-5', '2010-02-30',
+            '2010-13-01', '2010-01-05 ', '2010-01-05\n', '10-01-05', '',
+            '2010/01/05'])
+        assert api_to_date(None) is None
+        assert api_to_date('null') is None
+
+    def test_api_to_time(self):
+        reference = lambda value: datetime.time(
+                *time.strptime(value, '%H:%M:%S')[3:6])
+        self.assertSameAsStrptime(api_to_time, reference, ['00:00:00',
+            u'23:59:59', '7:5:3', '24:00:00', '12:60:00', '12:00:60',
+            '12:00:61', '12:00', '12:00:00\n'])
+        assert api_to_time('none') is None
+
+    def test_api_to_datetime(self):
+        reference = lambda value: datetime.datetime(
+                *time.strptime(value, '%Y-%m-%d %H:%M:%S')[:6])
+        self.assertSameAsStrptime(api_to_datetime, reference, [
+            '2010-01-05 12:30:45', u'2010-01-05 00:00:00',
+            '2010-01-05  12:30:45', '2010-1-5 1:2:3', '2010-01-05T12:30:45',
+            '2010-02-30 12:30:45', '2010-01-05 12:30'])
+        assert api_to_datetime(None) is None
+
+    def test_convert_column(self):
+        converter = Mock(side_effect=api_to_date)
+        dates = convert_column(converter,
+                ['2010-01-05', None, '2010-01-05', '2010-01-06'])
+        assert dates == [datetime.date(2010, 1, 5), None,
+                datetime.date(2010, 1, 5), datetime.date(2010, 1, 6)]
+        assert converter.call_count == 3
+
 class TripsTests(BaseTestCase):
     """Tests of the trip lib.
 
@@ -92,6 +1311,12 @@ class TripsTests(BaseTestCase):
         'trip_search_demands': {'trip_demands': [{'title': 'value'}, {'title2': 'value2'}], 'trip_offers': None, 'trip': None},
     }.items())
 
+    def setUp(self):
+        BaseTestCase.setUp(self)
+        self.lib.use_city_index = False
+        for method in ('_get_cities', 'get_cartypes', 'calculate_buffer'):
+            getattr(LibTrips, method).cache_clear()
+
     def test_transform_dows(self):
         params = (
             ({}, {}),
@@ -111,6 +1336,22 @@ class TripsTests(BaseTestCase):
         assert trips[1].title2 == 'value2'
         res.get.assert_called_with(count=20, start=0)
     
+    def test_list_trips_stream(self):
+        res = self._mock_resource_method('get', 'collection')
+        trips = self.lib.list_trips(stream=True)
+        assert not isinstance(trips, list)
+        trips = list(trips)
+        assert trips[0].title == 'value'
+        assert trips[1].title2 == 'value2'
+        res.get.assert_called_with(count=20, start=0)
+
+    def test_iter_search_trip(self):
+        res = self._mock_resource_method('get', 'trip_search_offers')
+        results = list(self.lib.iter_search_trip(trip_type='1'))
+        assert [key for key, trip in results] == ['trip_offers'] * 2
+        assert results[0][1].title == 'value'
+        res.get.assert_called_with(trip_type='1', is_demand=True)
+
     def test_list_empty_trips(self): 
         # when an empty collection is returned, a empty list must be built
         res = self._mock_resource_method('get', 'emptycollection')
@@ -237,6 +1478,23 @@ class TripsTests(BaseTestCase):
         assert cartypes[0].title == 'value'
         assert cartypes[1].title2 == 'value2'
 
+    def test_reference_data_cached(self):
+        res = self._mock_resource_method('get', 'collection')
+        self.lib.get_cartypes()
+        cartypes = self.lib.get_cartypes()
+        assert res.get.call_count == 1
+        assert cartypes[1].title2 == 'value2'
+        cartypes.pop()
+        assert len(self.lib.get_cartypes()) == 2
+
+        self.lib.calculate_buffer({'a': [1, 2]})
+        self.lib.calculate_buffer({'a': [1, 2]})
+        self.lib.calculate_buffer({'a': [1]})
+        assert res.get.call_count == 3
+        info = self.lib.calculate_buffer.cache_info()
+        assert (info['hits'], info['misses'], info['size']) == (1, 2, 2)
+        assert info['ratio'] == 1 / 3.0
+
 class TalksTests(BaseTestCase):
     """Tests of the talks lib.
 
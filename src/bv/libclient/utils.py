@@ -1,6 +1,14 @@
-import json
+import re
 import time
 import datetime
+import threading
+import inspect
+import types
+from collections import OrderedDict
+
+from bv.libclient.jsonstream import iter_json_array
+from bv.libclient.jsoncodec import loads as json_loads, dumps as json_dumps
+from bv.libclient.constants import DATE_CACHE_MAX_ENTRIES
 
 """A set of utilities relative to the lib module. (decorators, classes, callables)
 
@@ -24,98 +32,627 @@ def json_unpack(unpack_field='body_string'):
                 resp = getattr(resp, unpack_field)
                 if callable(resp):
                     resp = resp()
-            return json.loads(resp)
+            return json_loads(resp)
+        # give access to the undecoded response, for streaming
+        wrapped.raw = func
         return wrapped
     return wrapper
 
-def dict_to_object_func(dict, object):
+def get_lib_identity_map(args):
+    """Return the identity map of the lib a decorated method is called on.
+
+    """
+    if args:
+        return getattr(args[0], 'identity_map', None)
+    return None
+
+def dict_to_object_func(dict, object, identity_map=None):
     """Transform a dict into the specific object
+
+    The nested objects are built through identity_map, or through a new one
+    for this dict only.
     """
     if is_iterable(dict):
-        return object(**unicode_to_dict(dict)) 
+        if identity_map is None:
+            identity_map = IdentityMap()
+        return identity_map.build(get_model_class(object), dict)
     else:
         return None
 
-def dict_to_object_list_func(dict, object):
+def dict_to_object_list_func(dict, object, identity_map=None):
     """Transform a dict into the specific list of objects
+
+    The objects of the list share the same identity map.
     """
-    return [dict_to_object_func(d, object) for d in dict]
+    if identity_map is None:
+        identity_map = IdentityMap()
+    return [dict_to_object_func(d, object, identity_map) for d in dict]
 
 def dict_to_object(object):
     def wrapper(func):
         def wrapped(*args, **kwargs):
-            return dict_to_object_func(func(*args, **kwargs), object)
+            return dict_to_object_func(func(*args, **kwargs), object,
+                    get_lib_identity_map(args))
         return wrapped
     return wrapper
 
+def dict_to_object_iter(dicts, object, identity_map=None):
+    """Lazily transform an iterable of dicts into objects.
+    """
+    if identity_map is None:
+        identity_map = IdentityMap()
+    for d in dicts:
+        yield dict_to_object_func(d, object, identity_map)
+
 def dict_to_object_list(object):
+    """Transform the list returned by the decorated method into a list of
+    objects.
+
+    If the method is called with stream=True and its response is unpacked
+    by json_unpack, the body is decoded incrementally and a generator of
+    objects is returned instead.
+    """
     def wrapper(func):
         def wrapped(*args, **kwargs):
-            return dict_to_object_list_func(func(*args, **kwargs), object)
+            if kwargs.pop('stream', False) and hasattr(func, 'raw'):
+                return dict_to_object_iter(
+                    iter_json_array(func.raw(*args, **kwargs)), object,
+                    get_lib_identity_map(args))
+            return dict_to_object_list_func(func(*args, **kwargs), object,
+                    get_lib_identity_map(args))
+        return wrapped
+    return wrapper
+
+def make_cache_key(value):
+    """Return a hashable version of value, converting the dicts and lists it
+    contains.
+
+    """
+    if isinstance(value, dict):
+        return tuple(sorted([(k, make_cache_key(v)) for k, v in value.items()]))
+    if isinstance(value, (list, tuple)):
+        return tuple([make_cache_key(v) for v in value])
+    return value
+
+def memoize(ttl, max_entries):
+    """Cache the results of a lib method for ttl seconds.
+
+    The cache key is made of the server url of the lib and of the arguments
+    of the call; at most max_entries results are kept, the least recently
+    used ones being evicted first. Lists are copied before being returned, so
+    callers can't alter the cached value. The streamed calls (stream=True)
+    and the results that are generators are not cached, as they can only be
+    consumed once.
+
+    The decorated method gets a `cache_info()` function returning the hits,
+    misses, hit ratio and size of the cache, and a `cache_clear()` one.
+
+    """
+    def wrapper(func):
+        entries = OrderedDict()
+        stats = {'hits': 0, 'misses': 0}
+        lock = threading.Lock()
+
+        def wrapped(lib, *args, **kwargs):
+            if kwargs.get('stream'):
+                return func(lib, *args, **kwargs)
+            key = (getattr(lib, 'server_url', None), make_cache_key(args),
+                    make_cache_key(kwargs))
+            now = time.time()
+            lock.acquire()
+            try:
+                entry = entries.pop(key, None)
+                if entry is not None and entry[0] > now:
+                    entries[key] = entry
+                    stats['hits'] += 1
+                    result = entry[1]
+                else:
+                    entry = None
+                    stats['misses'] += 1
+            finally:
+                lock.release()
+            if entry is None:
+                result = func(lib, *args, **kwargs)
+                if isinstance(result, types.GeneratorType):
+                    return result
+                lock.acquire()
+                try:
+                    entries[key] = (now + ttl, result)
+                    while len(entries) > max_entries:
+                        entries.popitem(last=False)
+                finally:
+                    lock.release()
+            if isinstance(result, list):
+                result = list(result)
+            return result
+
+        def cache_info():
+            total = stats['hits'] + stats['misses']
+            return {
+                'hits': stats['hits'],
+                'misses': stats['misses'],
+                'ratio': total and float(stats['hits']) / total or 0.0,
+                'size': len(entries),
+            }
+
+        def cache_clear():
+            lock.acquire()
+            try:
+                entries.clear()
+                stats['hits'] = stats['misses'] = 0
+            finally:
+                lock.release()
+
+        wrapped.__name__ = func.__name__
+        wrapped.__doc__ = func.__doc__
+        wrapped.cache_info = cache_info
+        wrapped.cache_clear = cache_clear
         return wrapped
     return wrapper
 
 #Model classes
+_compact_models = False
+
+def set_compact_models(enabled=True):
+    """Build the objects returned by the libs with their compact class, when
+    they declare their fields (see ApiObject.get_compact_class).
+
+    """
+    global _compact_models
+    _compact_models = enabled
+
+def get_model_class(klass):
+    """Return the class to use to build objects of klass.
+
+    """
+    if _compact_models and getattr(klass, '_fields', None):
+        return klass.get_compact_class()
+    return klass
+
+class _CurrentIdentityMap(threading.local):
+    map = None
+
+_current_identity_map = _CurrentIdentityMap()
+
+class IdentityMap(object):
+    """Share one instance between the identical nested objects of a
+    response, like the same user repeated in a list of ratings.
+
+    Nested objects are looked up by class and id, and reused only if they
+    were built from an equal dict. A map can be kept for several responses,
+    eg. for the duration of a request (see BaseLib.identity_map).
+
+    """
+    def __init__(self):
+        self._objects = {}
+        self.hits = 0
+        self.misses = 0
+
+    def build(self, klass, data):
+        """Build an object of klass, its nested objects using this map.
+
+        """
+        previous = _current_identity_map.map
+        _current_identity_map.map = self
+        try:
+            return klass(**unicode_to_dict(data))
+        finally:
+            _current_identity_map.map = previous
+
+    def get_object(self, klass, data):
+        """Return the object of klass already built from data, or build it.
+
+        """
+        key = None
+        if isinstance(data, dict) and data.get('id') is not None:
+            key = (klass, data['id'])
+            entry = self._objects.get(key)
+            if entry is not None and (entry[0] is data or entry[0] == data):
+                self.hits += 1
+                return entry[1]
+        self.misses += 1
+        obj = self.build(klass, data)
+        if key is not None:
+            self._objects[key] = (data, obj)
+        return obj
+
+    def clear(self):
+        self._objects.clear()
+
+    def __len__(self):
+        return len(self._objects)
+
+class _CompactAttrs(object):
+    """Store the attributes of a compact object in its slots, and the
+    undeclared ones in its _extra dict.
+
+    """
+    __slots__ = ('obj', 'slots')
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.slots = obj._slots
+
+    def __setitem__(self, key, value):
+        if key in self.slots:
+            setattr(self.obj, key, value)
+        else:
+            if self.obj._extra is None:
+                self.obj._extra = {}
+            self.obj._extra[key] = value
+
+class CompactApiObject(object):
+    """Base of the compact classes built by ApiObject.get_compact_class.
+
+    """
+    __slots__ = ('_extra', '_raw', '_identity_map')
+    _slots = frozenset()
+
+    def _get_attrs(self):
+        self._extra = None
+        self._raw = None
+        self._identity_map = None
+        return _CompactAttrs(self)
+
+    def _set_attr(self, key, value):
+        _CompactAttrs(self)[key] = value
+
+    def __getattr__(self, name):
+        if name in ('_extra', '_raw', '_identity_map'):
+            raise AttributeError(name)
+        extra = self._extra
+        if extra is not None and name in extra:
+            return extra[name]
+        return self._get_lazy_attr(name)
+
+    def _get_fields(self):
+        """Return a dict of the attributes set on this object.
+
+        """
+        fields = dict(self._extra or {})
+        for name in self._slots:
+            try:
+                fields[name] = getattr(self, name)
+            except AttributeError:
+                pass
+        for name in list(self._raw or ()):
+            fields[name] = getattr(self, name)
+        return fields
+
+    def __dir__(self):
+        return [name for name in dir(self.__class__)
+            if name not in self._slots] + self._get_fields().keys()
+
+    def __reduce__(self):
+        return (_restore_compact, (self._model_class, self._get_fields()))
+
+def _restore_compact(klass, fields):
+    """Unpickle a compact object of klass.
+
+    """
+    compact = klass.get_compact_class()
+    obj = compact.__new__(compact)
+    attrs = obj._get_attrs()
+    for key, value in fields.items():
+        attrs[key] = value
+    return obj
+
 class ApiObject:
     """Base Api Object.
     You can define clean_* methods that will be called to format
     properly the adequate attributes when supplied on __init__.
     """
     _class_keys = {}
+    # attributes stored in slots by the compact version of the class
+    _fields = ()
+    # if True, cleaners and nested classes are only applied on first access
+    _lazy_hydration = False
+    _raw = None
+    # identity map of the response, kept to build the lazy nested objects
+    _identity_map = None
     def __init__(self, **kwargs):
         """Build an object thanks to the dict given in param.
 
         Set all attributes by using cleaner_* function when appropriate
         """
+        plan = self._get_hydration_plan()
+        attrs = self._get_attrs()
+        identity_map = _current_identity_map.map
+        raw = None
         for key, value in kwargs.items():
-            cleaner = 'clean_'+key
-            if hasattr(self, cleaner) and callable(getattr(self, cleaner)):
-                cleaner_callable = getattr(self, cleaner)
-                value = cleaner_callable(value)
-            if is_iterable(value):
-                if key in self._class_keys:
-                    klass = self._class_keys[key]
-                    value = klass(**unicode_to_dict(value))
-            setattr(self, key, value) 
-
-    def to_dict(self, init={}):
+            step = plan.get(key)
+            if step is not None:
+                if self._lazy_hydration:
+                    if raw is None:
+                        raw = self._raw = {}
+                        if identity_map is not None:
+                            self._identity_map = identity_map
+                    raw[key] = value
+                    continue
+                value = self._hydrate(step, value, identity_map)
+            attrs[key] = value
+
+    def _hydrate(self, step, value, identity_map=None):
+        """Apply a step of the hydration plan to value, building the nested
+        objects through identity_map if given.
+
+        """
+        cleaner, method, klass = step
+        if method:
+            value = cleaner(self, value)
+        elif cleaner is not None:
+            value = cleaner(value)
+        if klass is not None and is_iterable(value):
+            if identity_map is not None:
+                value = identity_map.get_object(klass, value)
+            else:
+                value = klass(**unicode_to_dict(value))
+        return value
+
+    def _get_lazy_attr(self, name):
+        """Hydrate and cache the raw value of a lazy attribute.
+
+        """
+        raw = self._raw
+        if raw is not None:
+            try:
+                value = raw[name]
+            except KeyError:
+                pass
+            else:
+                value = self._hydrate(self._get_hydration_plan()[name], value,
+                        self._identity_map)
+                self._set_attr(name, value)
+                raw.pop(name, None)
+                if not raw:
+                    # everything is hydrated, the raw values and the map are
+                    # not needed anymore
+                    self._raw = None
+                    self._identity_map = None
+                return value
+        raise AttributeError("'%s' object has no attribute '%s'" % (
+            self.__class__.__name__, name))
+
+    def __getattr__(self, name):
+        return self._get_lazy_attr(name)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_identity_map', None)
+        if state.get('_raw') is not None:
+            # hydrating one copy must not empty the raw values of the other
+            state['_raw'] = dict(state['_raw'])
+        return state
+
+    @classmethod
+    def _get_hydration_plan(cls):
+        """Return the plan of the class, mapping each key having a cleaner or
+        a nested class to a (cleaner, cleaner is a method, class) tuple.
+
+        The plan is computed once per class, on the first instantiation.
+        """
+        plan = cls.__dict__.get('_hydration_plan')
+        if plan is None:
+            plan = {}
+            for name in dir(cls):
+                if name.startswith('clean_'):
+                    cleaner = getattr(cls, name)
+                    if callable(cleaner):
+                        # regular methods are unbound and need the instance
+                        method = getattr(cleaner, 'im_self', False) is None
+                        if method:
+                            cleaner = cleaner.im_func
+                        plan[name[len('clean_'):]] = (cleaner, method, None)
+            for key, klass in cls._class_keys.items():
+                cleaner, method, _ = plan.get(key, (None, False, None))
+                plan[key] = (cleaner, method, klass)
+            cls._hydration_plan = plan
+        return plan
+
+    def _get_attrs(self):
+        """Return the mapping in which __init__ stores the attributes.
+
+        """
+        return self.__dict__
+
+    def _set_attr(self, key, value):
+        self.__dict__[key] = value
+
+    @classmethod
+    def get_compact_class(cls):
+        """Return a memory efficient version of the class, storing the
+        attributes declared in `_fields` in slots instead of a per-instance
+        dict. Undeclared attributes are kept in a small dict, created only if
+        needed. Nested classes declaring their fields are compact too.
+
+        Compact classes are new-style copies of the original class: they
+        behave the same, but are not subclasses of it.
+
+        """
+        compact = cls.__dict__.get('_compact_class')
+        if compact is None:
+            attrs = {}
+            for base in reversed(inspect.getmro(cls)):
+                attrs.update(base.__dict__)
+            for name in CompactApiObject.__dict__.keys() + [
+                    '__dict__', '__weakref__', '__getstate__',
+                    '_hydration_plan', '_compact_class', '_class_fields']:
+                attrs.pop(name, None)
+            slots = tuple([name for name in cls._fields if name not in attrs])
+            attrs['__slots__'] = slots
+            attrs['_slots'] = frozenset(slots)
+            attrs['_class_keys'] = dict([(key, getattr(klass, '_fields', None)
+                and klass.get_compact_class() or klass)
+                for key, klass in cls._class_keys.items()])
+            attrs['__module__'] = cls.__module__
+            attrs['_model_class'] = cls
+            compact = type(cls.__name__, (CompactApiObject,), attrs)
+            compact._compact_class = compact
+            cls._compact_class = compact
+        return compact
+
+    @classmethod
+    def _get_class_fields(cls):
+        """Return the names of the public class attributes that are not
+        methods (mostly properties), computed once per class.
+
+        """
+        names = cls.__dict__.get('_class_fields')
+        if names is None:
+            slots = getattr(cls, '_slots', ())
+            names = tuple([name for name in dir(cls)
+                if not name.startswith('_') and name not in slots
+                and not callable(getattr(cls, name))])
+            cls._class_fields = names
+        return names
+
+    def _get_fields(self):
+        """Return a dict of the attributes set on this object.
+
+        """
+        fields = dict(self.__dict__)
+        for name in list(self._raw or ()):
+            fields[name] = getattr(self, name)
+        return fields
+
+    def to_dict(self, init=None):
         """Return a dict based on the object itself.
 
         """
-        keys = [item for item in dir(self) if not (callable(getattr(self, item)) or item.startswith(('__', '_')))]
-        for key in keys:
-            init[key] = getattr(self, key)
+        if init is None:
+            init = {}
+        for key, value in self._get_fields().items():
+            if not (key.startswith('_') or callable(value)):
+                init[key] = value
+        for key in self._get_class_fields():
+            if key not in init:
+                init[key] = getattr(self, key)
         return init
+
+    def to_json(self):
+        """Return the object as a json string, nested objects and dates
+        included, dates being in the API formats.
+
+        """
+        return json_dumps(to_serializable(self))
     
     def get(self, attr, default=False):
         return getattr(self, attr, default)
 
 # convertors
+_DATE_RE = re.compile(r'(\d{4})-(\d\d)-(\d\d)\Z')
+_TIME_RE = re.compile(r'(\d\d):(\d\d):(\d\d)\Z')
+_DATETIME_RE = re.compile(
+        r'(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d)\Z')
+
+def memoize_converter(max_entries=DATE_CACHE_MAX_ENTRIES):
+    """Cache the results of a converter of strings, as the same dates come
+    back again and again in a page.
+
+    The cache is emptied when it holds max_entries results; the values that
+    fail to convert are not cached.
+
+    """
+    def wrapper(func):
+        cache = {}
+
+        def wrapped(value):
+            try:
+                return cache[value]
+            except KeyError:
+                pass
+            except TypeError:
+                # unhashable values
+                return func(value)
+            result = func(value)
+            if len(cache) >= max_entries:
+                cache.clear()
+            cache[value] = result
+            return result
+        wrapped.cache_clear = cache.clear
+        wrapped.__name__ = func.__name__
+        wrapped.__doc__ = func.__doc__
+        return wrapped
+    return wrapper
+
+@memoize_converter()
 def api_to_date(value):
     """Convert a date from YYYY-MM-DD format to a real python date object.
     
     """
     if is_null(value):
         return None
+    match = _DATE_RE.match(value)
+    if match:
+        return datetime.date(*map(int, match.groups()))
     return datetime.date(*time.strptime(value, '%Y-%m-%d')[:3])
     
+@memoize_converter()
 def api_to_time(value):
     """Convert a date from h:m:s format to a real python datetime object.
     
     """
     if is_null(value):
         return None
+    match = _TIME_RE.match(value)
+    if match:
+        return datetime.time(*map(int, match.groups()))
     return datetime.time(*time.strptime(value, '%H:%M:%S')[3:6])
 
 
+@memoize_converter()
 def api_to_datetime(value):
     """Convert a date from yyyy:mm:dd h:m:s format to a real python datetime object.
     
     """
     if value in (None, 'null', 'none'):
         return None
+    match = _DATETIME_RE.match(value)
+    if match:
+        return datetime.datetime(*map(int, match.groups()))
     return datetime.datetime(*time.strptime(value, '%Y-%m-%d %H:%M:%S')[:6])
+
+def convert_column(converter, values):
+    """Convert a list of values at once, each distinct value being converted
+    only once.
+
+    """
+    converted = {}
+    result = []
+    for value in values:
+        try:
+            result.append(converted[value])
+        except KeyError:
+            converted[value] = converter(value)
+            result.append(converted[value])
+    return result
     
+_JSON_SCALARS = frozenset([unicode, str, int, long, float, bool, type(None)])
+
+def to_serializable(value):
+    """Convert objects, dates and times, even nested in lists and dicts, to
+    values that can be encoded in json.
+
+    """
+    if type(value) in _JSON_SCALARS:
+        return value
+    if isinstance(value, (ApiObject, CompactApiObject)):
+        return dict([(key, to_serializable(item))
+            for key, item in value.to_dict().items()])
+    if isinstance(value, datetime.datetime):
+        return '%04d-%02d-%02d %02d:%02d:%02d' % (value.year, value.month,
+                value.day, value.hour, value.minute, value.second)
+    if isinstance(value, datetime.date):
+        return '%04d-%02d-%02d' % (value.year, value.month, value.day)
+    if isinstance(value, datetime.time):
+        return '%02d:%02d:%02d' % (value.hour, value.minute, value.second)
+    if isinstance(value, dict):
+        return dict([(key, to_serializable(item))
+            for key, item in value.items()])
+    if isinstance(value, (list, tuple)):
+        return [to_serializable(item) for item in value]
+    return value
+
 def date_to_api(value):
     """Convert a date in format DD/MM/YYYY to YYYY-MM-DD
     
@@ -0,0 +1,170 @@
+"""A small pool of worker threads, used to run lib calls concurrently.
+
+"""
+import sys
+import threading
+import Queue
+
+from bv.libclient.constants import DEFAULT_WORKERS
+from bv.libclient.exceptions import FutureTimeout
+
+class Future(object):
+    """The result of a call running in a worker pool.
+
+    """
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.isSet()
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        """Store the exception raised by the call, as returned by
+        sys.exc_info().
+
+        """
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        self._lock.acquire()
+        try:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        finally:
+            self._lock.release()
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        """Call callback with the future as argument once it is done.
+
+        """
+        self._lock.acquire()
+        try:
+            if not self._done.isSet():
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._lock.release()
+        callback(self)
+
+    def exception(self, timeout=None):
+        """Return the exception raised by the call, or None.
+
+        """
+        self._wait(timeout)
+        if self._exc_info:
+            return self._exc_info[1]
+        return None
+
+    def result(self, timeout=None):
+        """Wait for the call to finish and return its result, or raise its
+        exception.
+
+        """
+        self._wait(timeout)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def _wait(self, timeout):
+        self._done.wait(timeout)
+        if not self._done.isSet():
+            raise FutureTimeout('The call did not finish in %s seconds' %
+                    timeout)
+
+class WorkerPool(object):
+    """Run callables in a fixed number of daemon threads.
+
+    Threads are only started on the first submitted call.
+
+    """
+    def __init__(self, size=DEFAULT_WORKERS):
+        self.size = size
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        self._lock.acquire()
+        try:
+            while len(self._threads) < self.size:
+                thread = threading.Thread(target=self._work)
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, func, args, kwargs = item
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                future.set_exception(sys.exc_info())
+            else:
+                future.set_result(result)
+
+    def submit(self, func, *args, **kwargs):
+        """Schedule func(*args, **kwargs) and return its Future.
+
+        """
+        if len(self._threads) < self.size:
+            self._start()
+        future = Future()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def map(self, func, iterable):
+        """Schedule func for each item of iterable and return the list of
+        Futures, in the same order.
+
+        """
+        return [self.submit(func, item) for item in iterable]
+
+    def shutdown(self):
+        """Stop the threads once the already submitted calls are done.
+
+        """
+        self._lock.acquire()
+        try:
+            for thread in self._threads:
+                self._queue.put(None)
+            self._threads = []
+        finally:
+            self._lock.release()
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+def get_worker_pool():
+    """Return the worker pool shared by default by all the libs.
+
+    """
+    global _default_pool
+    _default_pool_lock.acquire()
+    try:
+        if _default_pool is None:
+            _default_pool = WorkerPool()
+        return _default_pool
+    finally:
+        _default_pool_lock.release()
+
+def wait_all(futures, timeout=None):
+    """Return the results of the futures, in the same order.
+
+    """
+    return [future.result(timeout) for future in futures]